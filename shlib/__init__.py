@@ -10,14 +10,16 @@ from .shlib import (
     set_prefs, get_state, set_state,
 
     # filesystem utilities
-    cp, mv, rm, ln, touch, mkdir, mount, umount, is_mounted, cd, cwd,
-    chmod, getmod, ls, lsd, lsf,
+    cp, mv, mv_many, rm, rm_wait, ln, touch, mkdir, mount, umount, is_mounted,
+    cd, cwd, chmod, getmod, getmod_many, stat_many, ls, lsd, lsf, StatRecord,
+    StatArrays, CopySummary,
 
     # path expansion utilities
     leaves, cartesian_product, brace_expand,
 
     # execution utilities
-    Cmd, Run, Start, which, split_cmd, quote_arg, render_command,
+    Cmd, Run, Start, run_many, AsyncCmd, AsyncRun, which, split_cmd, quote_arg,
+    render_command,
 
     # deprecated execution utilities
     run, sh, bg, shbg,
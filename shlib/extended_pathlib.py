@@ -151,6 +151,64 @@ def _sans_ext(path):
 
 PosixPath.sans_ext = _sans_ext
 
+# write_atomic {{{1
+def _write_atomic(path, data, encoding=None, errors=None, fsync=True):
+    """
+    Write bytes or text to the file atomically.
+
+    The data is written to a temporary file in the same directory that is then
+    renamed over the file, so readers see either the old or the new contents,
+    never a mixture.  The permissions of an existing file are retained.  If
+    fsync is true, the file and its directory are flushed to disk before
+    returning.  Returns the number of bytes or characters written.
+
+    >>> Path('/tmp/greeting').write_atomic('hello')
+    5
+
+    """
+    from uuid import uuid4
+
+    if isinstance(data, six.text_type):
+        if encoding is None:
+            import locale
+
+            encoding = locale.getpreferredencoding(False)  # as write_text()
+        count, data = len(data), data.encode(encoding, errors or "strict")
+    else:
+        count = len(data)
+    path = str(path)
+    head, tail = os.path.split(path)
+    temp = os.path.join(head, ".{}.tmp-{}".format(tail, uuid4().hex))
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        try:
+            os.fchmod(fd, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        if fsync:
+            os.fsync(fd)
+        os.close(fd)
+        fd = None
+        os.replace(temp, path)
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        os.unlink(temp)
+        raise
+    if fsync:
+        fd = os.open(head or ".", os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    return count
+
+
+PosixPath.write_atomic = _write_atomic
+
 # humanize {{{1
 def _humanize(path):
     """
@@ -17,12 +17,18 @@ except ImportError:
 import errno
 import itertools
 import os
+import re
 import shutil
+import threading
+from stat import S_ISDIR, S_ISREG, S_ISSOCK
 
 from six import string_types
 
 # Parameters {{{1
 PREFERENCES = dict(encoding="utf-8", log_cmd=False, use_inform=False,)
+MAX_DIR_FDS = 128
+    # directories deeper than this are read by path rather than relative to a
+    # descriptor for their parent when walking a tree
 
 
 # Utilities {{{1
@@ -147,73 +153,1123 @@ def set_state(state):
 
 # File system utility functions (cp, mv, rm, ln, touch, mkdir, ls, etc.) {{{1
 # cp {{{2
-def cp(*paths):
-    "Copy files or directories (equivalent to 'cp -rf')"
+def cp(
+    *paths, workers=None, update=False, sparse=False, preserve_hardlinks=False,
+    atomic=False, fsync=False, progress=None, resume=False, verify=None,
+    summary=None
+):
+    """
+    Copy files or directories (equivalent to 'cp -rf')
+
+    The data in files is copied using the fastest method available: a reflink
+    (a copy-on-write clone, supported by btrfs and XFS) where possible,
+    otherwise copy_file_range or sendfile, which copy within the kernel,
+    falling back to reading and writing buffers.
+
+    workers (int):
+        If greater than 1, files are copied concurrently using that many
+        threads.  Directories are created before the files they contain are
+        copied and their metadata is copied once all files have been copied.
+        Failures are collected from all workers; a single failure copying a
+        file named directly is raised as is, otherwise shutil.Error is raised
+        with the list of failures, as with directory trees.
+    update (bool or 'checksum'):
+        If true, directories that already exist at the destination are reused
+        and files that already exist are only copied if they differ from the
+        source, otherwise they are skipped.  Normally files differ if their
+        sizes or modification times differ; if update is 'checksum', they
+        differ if their sizes or the SHA-256 digests of their contents differ.
+    sparse (bool):
+        If true, the holes in sparse files are preserved: only the extents
+        that contain data are copied and the rest of the copy is left as
+        holes.  Applies to files that occupy less space than their size.
+    preserve_hardlinks (bool):
+        If true, files that are hard links to the same file are copied once
+        and the copies are linked together in the same way.
+    atomic (bool):
+        If true, each file is copied to a temporary file in the destination
+        directory that is then renamed over the destination, so the
+        destination never contains a partially written file.
+    fsync (bool or 'batch'):
+        If true, each file is flushed to disk once it is copied and, if
+        atomic, the directory is flushed once it is renamed.  If 'batch', the
+        files are flushed at the end of the copy, when much of the data has
+        already been written back, and each directory is flushed only once.
+        When combined with atomic, the files are renamed after they are
+        flushed.
+    progress (callable):
+        If given, files are copied in chunks and progress is called after each
+        chunk with the destination, the number of bytes copied so far, the
+        size of the file, and the throughput in bytes per second.  With
+        workers it is called from the worker threads.
+    resume (bool):
+        If true, files are written to a temporary file with a fixed name
+        (.<name>.cp-partial) that is retained if the copy fails and renamed
+        over the destination once it is complete.  If the temporary file
+        exists, the copy continues from where it ends, provided that a sample
+        of it matches the source: its last megabyte and 16 megabyte-sized
+        blocks spread evenly over it, starting with the first.  Data outside
+        of the sample is not checked.  progress is called as the sample is
+        checked.  The destination itself is never taken to be a partial copy.
+    verify (str):
+        The name of a hash algorithm, such as 'sha256'.  If given, the data is
+        hashed as it is copied and the copy is then flushed to the disk, read
+        back, bypassing the cache where possible, and hashed.  An OSError is
+        raised if the digests differ.  The digests are recorded in
+        the summary.
+    summary (CopySummary):
+        If given, it is updated with the number of files and bytes copied and
+        skipped, the number of files copied with each strategy and, if
+        verifying, the digest of each file copied.
+    """
     dest = to_path(paths[-1])
     srcs = list(to_paths(paths[:-1]))
     if dest.is_dir():
-        for src in srcs:
+        pairs = [(src, Path(dest, src.name)) for src in srcs]
+    else:
+        if len(srcs) > 1:
+            raise_os_error(errno.ENOTDIR, dest)
+        src = srcs[0]
+        if src.is_dir() and dest.is_file():
+            raise_os_error(errno.EISDIR, src)
+        pairs = [(src, dest)]
+
+    copier = _Copier(
+        summary, update=update, sparse=sparse, atomic=atomic, fsync=fsync,
+        progress=progress, resume=resume, verify=verify
+    )
+    try:
+        if update or preserve_hardlinks or workers and workers > 1:
+            _copytree(
+                pairs, copier, workers, exist_ok=bool(update),
+                hardlinks=preserve_hardlinks
+            )
+            return
+        for src, dest in pairs:
             if src.is_dir():
-                fulldest = Path(dest, src.name)
-                # required because dest cannot exist with copytree
-                shutil.copytree(to_str(src), to_str(fulldest))
+                # dest must not exist
+                shutil.copytree(to_str(src), to_str(dest), copy_function=copier)
             else:
-                shutil.copy2(to_str(src), to_str(dest))
-        return
-    if len(srcs) > 1:
-        raise_os_error(errno.ENOTDIR, dest)
-    src = srcs[0]
-    if src.is_dir() and dest.is_file():
-        raise_os_error(errno.EISDIR, src)
-    if src.is_dir():
-        # src is directory and dest does not exist
-        shutil.copytree(to_str(src), to_str(dest))
+                copier(to_str(src), to_str(dest))
+    finally:
+        # complete the files whose flushes were deferred, even on failure
+        copier.commit()
+
+
+# _copytree {{{2
+def _copytree(
+    pairs, copier, workers=None, symlinks=False, exist_ok=False, hardlinks=False
+):
+    """
+    Copy files and directory trees, using a pool of threads if workers > 1.
+
+    pairs is a list of (src, dest) pairs, each of which is either a file or a
+    directory tree.  The trees are walked on the calling thread, creating the
+    directories as they are found and submitting the files to the pool.  Once
+    all files are copied the metadata of the directories is copied from the
+    bottom up, so that it is not disturbed by the files being added.  If
+    symlinks is true, symbolic links are copied as links rather than followed.
+    If exist_ok is true, directories that already exist are used as is.
+
+    If hardlinks is true, files with more than one link are tracked by their
+    device and inode numbers.  Only the first file found in each group is
+    copied, the rest are linked to its copy once all files are copied.
+    """
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+    errors = []
+    directories = []
+    futures = []
+    groups = {}
+    links = []
+
+    class Inline(object):
+        # runs the copies immediately on the calling thread
+        def submit(self, fn, *args):
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+    def mkdir(path):
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            if not exist_ok or not os.path.isdir(path):
+                raise
+
+    def copy_link(src, dest):
+        os.symlink(os.readlink(src), dest)
+        shutil.copystat(src, dest, follow_symlinks=False)
+
+    def copy_file(src, dest, named, stat):
+        if hardlinks:
+            try:
+                st = stat()
+            except OSError:
+                st = None  # let the copy report the error
+            if st and st.st_nlink > 1:
+                first = groups.setdefault((st.st_dev, st.st_ino), dest)
+                if first != dest:
+                    links.append((src, first, dest, named))
+                    return
+        futures.append((pool.submit(copier, src, dest), src, dest, named))
+
+    def hardlink(first, dest):
+        try:
+            if os.path.samefile(first, dest):
+                copier.record(None, 0)
+                return
+            os.unlink(dest)
+        except FileNotFoundError:
+            pass
+        os.link(first, dest)
+        copier.record("hardlink", 0)
+
+    if workers and workers > 1:
+        pool = ThreadPoolExecutor(max_workers=workers)
     else:
-        shutil.copy2(to_str(src), to_str(dest))
+        pool = Inline()
+    with pool:
+        for src, dest in pairs:
+            src, dest = str(src), str(dest)
+            if symlinks and os.path.islink(src):
+                futures.append(
+                    (pool.submit(copy_link, src, dest), src, dest, True)
+                )
+                continue
+            if not os.path.isdir(src):
+                copy_file(src, dest, True, lambda: os.stat(src))
+                continue
+            os.makedirs(dest, exist_ok=exist_ok)
+            stack = [(src, dest)]
+            while stack:
+                srcdir, destdir = stack.pop()
+                directories.append((srcdir, destdir))
+                try:
+                    with os.scandir(srcdir) as entries:
+                        entries = list(entries)
+                except OSError as e:
+                    errors.append((srcdir, destdir, e, False))
+                    continue
+                for entry in entries:
+                    srcpath = entry.path
+                    destpath = os.path.join(destdir, entry.name)
+                    try:
+                        if symlinks and entry.is_symlink():
+                            copy_link(srcpath, destpath)
+                        elif entry.is_dir():
+                            mkdir(destpath)
+                            stack.append((srcpath, destpath))
+                        else:
+                            copy_file(srcpath, destpath, False, entry.stat)
+                    except OSError as e:
+                        errors.append((srcpath, destpath, e, False))
+        for future, src, dest, named in futures:
+            e = future.exception()
+            if e is not None:
+                errors.append((src, dest, e, named))
+
+    try:
+        copier.commit()  # the links require the files to be in place
+    except OSError as e:
+        errors.append((e.filename, e.filename, e, False))
+
+    for src, first, dest, named in links:
+        try:
+            hardlink(first, dest)
+        except OSError as e:
+            errors.append((src, dest, e, named))
+
+    for src, dest in reversed(directories):
+        try:
+            shutil.copystat(src, dest)
+        except OSError as e:
+            errors.append((src, dest, e, False))
+
+    if len(errors) == 1 and errors[0][3]:
+        raise errors[0][2]
+    if errors:
+        raise shutil.Error([(src, dest, str(e)) for src, dest, e, _ in errors])
+
+
+# CopySummary {{{2
+class CopySummary(object):
+    """
+    Accumulates a summary of the files copied by cp().
+
+    Attributes:
+        copied (int):
+            The number of files copied.
+        bytes (int):
+            The number of bytes copied.
+        skipped (int):
+            The number of files skipped because they were up to date.
+        skipped_bytes (int):
+            The number of bytes in the files skipped.
+        digests (dict):
+            The digests of the files copied when verifying, indexed by the
+            destination.
+        strategies (dict):
+            The number of files copied using each strategy, which are 'reflink',
+            'copy_file_range', 'sendfile', 'sparse', 'buffered', 'hardlink'
+            (files linked to a file already copied) and 'special' (files that
+            are not regular files, which are copied by shutil.copy2).
+    """
+
+    def __init__(self):
+        self.copied = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.skipped_bytes = 0
+        self.strategies = {}
+        self.digests = {}
+
+    def __repr__(self):
+        return "{}(copied={}, bytes={}, skipped={}, strategies={})".format(
+            self.__class__.__name__, self.copied, self.bytes, self.skipped,
+            self.strategies
+        )
+
+
+# _Copier {{{2
+class _Copier(object):
+    # Copies the data and metadata of a file, recording the results in a
+    # summary.  Instances serve as the copy_function of shutil.copytree().
+    # If update is true, files that match the destination are skipped.  If
+    # sparse is true, the holes in sparse files are preserved.  If atomic is
+    # true, files are written to a temporary file that is then renamed over
+    # the destination.  fsync is True, False or 'batch', in which case the
+    # flushes and renames are deferred until commit() is called.  progress is
+    # called as chunks are copied and if resume is true, copies continue from
+    # the partial copies left in temporary files by earlier attempts.  verify
+    # is the name of the hash algorithm used to check the copies.
+    def __init__(
+        self, summary=None, update=False, sparse=False, atomic=False,
+        fsync=False, progress=None, resume=False, verify=None
+    ):
+        self.summary = summary
+        self.update = update
+        self.sparse = sparse
+        self.atomic = atomic
+        self.fsync = fsync
+        self.progress = progress
+        self.resume = resume
+        self.verify = verify
+        if verify:
+            import hashlib
+
+            hashlib.new(verify)  # raises ValueError if unknown
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def __call__(self, src, dest):
+        self.copy(os.fspath(src), os.fspath(dest))
+        return dest
+
+    def copy(self, src, dest):
+        st = os.stat(src)
+        if not S_ISREG(st.st_mode):
+            shutil.copy2(src, dest)
+            self.record("special", 0)
+            return
+        try:
+            dest_st = os.stat(dest)
+        except FileNotFoundError:
+            dest_st = None
+        if dest_st:
+            if os.path.samestat(st, dest_st):
+                raise shutil.SameFileError(
+                    "{!r} and {!r} are the same file".format(src, dest)
+                )
+            if self.update and self.unchanged(src, st, dest, dest_st):
+                self.record(None, st.st_size)
+                return
+        target = dest
+        if self.atomic or self.resume:
+            from uuid import uuid4
+
+            head, tail = os.path.split(dest)
+            suffix = "partial" if self.resume else uuid4().hex
+            target = os.path.join(head, ".{}.cp-{}".format(tail, suffix))
+        try:
+            with open(src, "rb") as fsrc:
+                check = self.reporter(dest, st.st_size, 0)
+                offset = self.resumable(fsrc.fileno(), st, target, check)
+                with open(target, "r+b" if offset else "wb") as fdst:
+                    sparse = self.sparse and st.st_blocks * 512 < st.st_size
+                    report = self.reporter(dest, st.st_size, offset)
+                    if self.verify:
+                        digest = _copy_hashed(
+                            fsrc.fileno(), fdst.fileno(), st.st_size,
+                            self.verify, sparse, offset, report
+                        )
+                        strategy = "sparse" if sparse else "buffered"
+                    else:
+                        strategy = _copy_data(
+                            fsrc.fileno(), fdst.fileno(), st.st_size, sparse,
+                            offset, report
+                        )
+                    if self.fsync is True:
+                        os.fsync(fdst.fileno())
+            if self.verify:
+                if _digest(target, self.verify, uncached=True) != digest:
+                    raise OSError(
+                        errno.EIO, "copy does not match source", dest
+                    )
+                self.record_digest(dest, digest)
+            shutil.copystat(src, target)
+            if self.fsync == "batch":
+                with self.lock:
+                    self.pending.append((target, dest))
+            elif target != dest:
+                os.replace(target, dest)
+        except BaseException:
+            if target != dest and not self.resume:
+                _unlink_quietly(target)
+            raise
+        if target != dest and self.fsync is True:
+            _fsync_dir(os.path.dirname(dest))
+        self.record(strategy, st.st_size - offset)
+
+    def resumable(self, infd, st, target, progress=None):
+        # returns the length of the partial copy if it can be resumed, else 0;
+        # rather than reading all of it, its first and last blocks and a few
+        # blocks spread evenly between them must match the source
+        if not self.resume:
+            return 0
+        try:
+            partial = os.stat(target)
+        except FileNotFoundError:
+            return 0
+        size = partial.st_size
+        if not S_ISREG(partial.st_mode) or not 0 < size <= st.st_size:
+            return 0
+        count = min(size, _BUFFER_SIZE)
+        last = size - count
+        starts = sorted(set(
+            [last] + [i * last // _RESUME_SAMPLES for i in range(_RESUME_SAMPLES)]
+        ))
+        with open(target, "rb") as f:
+            for start in starts:
+                data = os.pread(f.fileno(), count, start)
+                if len(data) != count or data != os.pread(infd, count, start):
+                    return 0
+                if progress:
+                    progress(start + count)
+        return size
+
+    def reporter(self, dest, size, offset):
+        # returns a function that passes the position in the copy to progress
+        if not self.progress:
+            return None
+        import time
+
+        started = time.monotonic()
+
+        def report(position):
+            elapsed = time.monotonic() - started
+            rate = (position - offset) / elapsed if elapsed > 0 else 0.0
+            self.progress(dest, position, size, rate)
+
+        return report
+
+    def commit(self):
+        # flush, and if atomic rename, the files whose flushes were deferred
+        with self.lock:
+            pending, self.pending = self.pending, []
+        directories = set()
+        try:
+            while pending:
+                target, dest = pending[-1]
+                fd = os.open(target, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                if target != dest:
+                    os.replace(target, dest)
+                    directories.add(os.path.dirname(dest))
+                pending.pop()
+        finally:
+            for target, dest in pending:
+                if target != dest and not self.resume:
+                    _unlink_quietly(target)
+        for directory in directories:
+            _fsync_dir(directory)
+
+    def unchanged(self, src, st, dest, dest_st):
+        if not S_ISREG(dest_st.st_mode) or st.st_size != dest_st.st_size:
+            return False
+        if self.update == "checksum":
+            return _digest(src) == _digest(dest)
+        return st.st_mtime_ns == dest_st.st_mtime_ns
+
+    def record_digest(self, dest, digest):
+        if self.summary is not None:
+            with self.lock:
+                self.summary.digests[dest] = digest
+
+    def record(self, strategy, size):
+        # a strategy of None indicates the file was skipped
+        if self.summary is None:
+            return
+        with self.lock:
+            summary = self.summary
+            if strategy is None:
+                summary.skipped += 1
+                summary.skipped_bytes += size
+                return
+            summary.copied += 1
+            summary.bytes += size
+            summary.strategies[strategy] = summary.strategies.get(strategy, 0) + 1
+
+
+# _copy_extents {{{2
+def _copy_extents(infd, outfd, size, offset=0, progress=None):
+    """
+    Copy the extents of a sparse file that contain data.
+
+    The extents are found using SEEK_DATA and SEEK_HOLE and each is copied to
+    the same offset in the output file, which is then extended to the size of
+    the input, leaving the gaps between the extents as holes.  The copy starts
+    at offset and progress, if given, is called with the position reached
+    after each chunk.
+    """
+    use_copy_file_range = hasattr(os, "copy_file_range")
+    chunk = _CHUNK_SIZE if progress else 2 ** 30
+    while offset < size:
+        try:
+            start = os.lseek(infd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                break  # nothing but holes remain
+            raise
+        end = os.lseek(infd, start, os.SEEK_HOLE)
+        while start < end:
+            count = min(end - start, chunk)
+            if use_copy_file_range:
+                try:
+                    count = os.copy_file_range(infd, outfd, count, start, start)
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED:
+                        raise
+                    use_copy_file_range = False
+                    continue
+            else:
+                data = os.pread(infd, min(count, _BUFFER_SIZE), start)
+                count = os.pwrite(outfd, data, start) if data else 0
+            if not count:
+                break  # file shrank while being copied
+            start += count
+            if progress:
+                progress(start)
+        offset = end
+    os.ftruncate(outfd, size)
+    if progress:
+        progress(size)
+
+
+# _fsync_dir {{{2
+def _fsync_dir(path):
+    # flush a directory, which makes the renames within it durable
+    fd = os.open(path or ".", os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# _unlink_quietly {{{2
+def _unlink_quietly(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+# _digest {{{2
+def _digest(path, algorithm="sha256", uncached=False):
+    # returns the hex digest of the contents of a file; if uncached, the file
+    # is first flushed, as dirty pages cannot be dropped, and then the kernel
+    # is asked to drop it from its cache so that the file is read from the
+    # disk rather than from memory
+    import hashlib
+
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        if uncached and hasattr(os, "posix_fadvise"):
+            getattr(os, "fdatasync", os.fsync)(f.fileno())
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        for block in iter(lambda: f.read(_BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# _copy_hashed {{{2
+def _copy_hashed(
+    infd, outfd, size, algorithm, sparse=False, offset=0, progress=None
+):
+    """
+    Copy the contents of one open file to another, returns their hex digest.
+
+    The data is copied through a buffer so that it can be hashed as it is
+    copied.  If sparse is true, blocks that contain only zeros are skipped,
+    leaving holes.  When resuming from offset, the data already copied is
+    read from the input to include it in the digest.
+    """
+    import hashlib
+
+    digest = hashlib.new(algorithm)
+    position = 0
+    while position < offset:
+        data = os.pread(infd, min(offset - position, _BUFFER_SIZE), position)
+        if not data:
+            break
+        digest.update(data)
+        position += len(data)
+    os.lseek(infd, offset, os.SEEK_SET)
+    os.lseek(outfd, offset, os.SEEK_SET)
+    reported = position = offset
+    zeros = bytes(_BUFFER_SIZE)
+    while True:
+        data = os.read(infd, _BUFFER_SIZE)
+        if not data:
+            break
+        digest.update(data)
+        if sparse and data == zeros[:len(data)]:
+            os.lseek(outfd, len(data), os.SEEK_CUR)
+        else:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(outfd, view):]
+        position += len(data)
+        if progress and position - reported >= _CHUNK_SIZE:
+            progress(position)
+            reported = position
+    if sparse:
+        os.ftruncate(outfd, position)
+    if progress:
+        progress(position)
+    return digest.hexdigest()
+
+
+# _copy_data {{{2
+_FICLONE = 0x40049409  # ioctl that creates a reflink on Linux
+_BUFFER_SIZE = 1024 * 1024
+_RESUME_SAMPLES = 16  # blocks compared before resuming, besides the last
+_CHUNK_SIZE = 64 * 1024 * 1024  # the size of the chunks when reporting progress
+_UNSUPPORTED = set(
+    getattr(errno, name) for name in
+    "EXDEV ENOSYS EINVAL EOPNOTSUPP ENOTSUP EBADF EPERM ETXTBSY".split()
+    if hasattr(errno, name)
+)
+
+
+def _copy_data(infd, outfd, size, sparse=False, offset=0, progress=None):
+    """
+    Copy the contents of one open file to another, returns the strategy used.
+
+    Tries a reflink, then copy_file_range, then sendfile, and finally falls
+    back to copying through a buffer.  The kernel methods are abandoned if the
+    filesystems do not support them, as long as nothing has been copied.  If
+    sparse is true and a reflink cannot be made, only the extents that contain
+    data are copied.
+
+    The copy starts at offset, which allows an interrupted copy to be resumed.
+    If progress is given, the data is copied in chunks and progress is called
+    with the position reached after each.
+    """
+    try:
+        import fcntl
+
+        fcntl.ioctl(outfd, _FICLONE, infd)
+        if progress:
+            progress(size)
+        return "reflink"
+    except (ImportError, OSError):
+        pass
+
+    if sparse and hasattr(os, "SEEK_DATA"):
+        _copy_extents(infd, outfd, size, offset, progress)
+        return "sparse"
+
+    os.lseek(infd, offset, os.SEEK_SET)
+    os.lseek(outfd, offset, os.SEEK_SET)
+    position = offset
+
+    def advance(count):
+        nonlocal position
+        position += count
+        if progress:
+            progress(position)
+
+    if progress:
+        chunk = _CHUNK_SIZE
+    else:
+        chunk = min(max(size - offset, 8 * 1024 * 1024), 2 ** 30)
+    kernel_methods = []
+    if hasattr(os, "copy_file_range"):
+        kernel_methods.append(
+            ("copy_file_range", lambda: os.copy_file_range(infd, outfd, chunk))
+        )
+    if hasattr(os, "sendfile"):
+        kernel_methods.append(
+            ("sendfile", lambda: os.sendfile(outfd, infd, None, chunk))
+        )
+    for name, method in kernel_methods:
+        copied = 0
+        try:
+            while True:
+                count = method()
+                if not count:
+                    break
+                copied += count
+                advance(count)
+        except OSError as e:
+            if copied or e.errno not in _UNSUPPORTED:
+                raise
+            continue
+        if copied:
+            return name
+        # nothing was copied; the file is either empty or is one whose
+        # contents are generated when read (/proc), so read it directly
+        break
+
+    while True:
+        data = os.read(infd, _BUFFER_SIZE)
+        if not data:
+            if progress and position == offset:
+                progress(position)  # nothing was left to copy
+            return "buffered"
+        view = memoryview(data)
+        while view:
+            view = view[os.write(outfd, view):]
+        advance(len(data))
 
 
 # mv {{{2
-def mv(*paths):
-    "Move file or directory (supports moves across filesystems)"
+def mv(*paths, workers=None):
+    """
+    Move file or directory (supports moves across filesystems)
+
+    Each item is renamed, using renameat2 with RENAME_NOREPLACE where
+    available so that an existing destination is never silently replaced when
+    the destination is not expected to exist.  If the destination is on a
+    different filesystem, the item is copied, preserving symbolic and hard
+    links, using workers threads if workers is greater than 1, and the
+    original is then removed in the background (see rm_wait()).
+    """
     dest = to_path(paths[-1])
     srcs = list(to_paths(paths[:-1]))
     assert len(srcs) >= 1
-    if dest.is_dir():
+    try:
+        dest_st = os.stat(str(dest))
+    except OSError:
+        dest_st = None
+    if dest_st and S_ISDIR(dest_st.st_mode):
         for src in srcs:
-            fulldest = Path(dest, src.name)
-            # required because dest cannot exist with shutil.move
-            shutil.move(to_str(src), to_str(fulldest))
+            # if it already exists, shutil.move decides what to do
+            _move(str(src), str(Path(dest, src.name)), workers, "move")
         return
-    else:
-        if len(srcs) > 1:
-            raise_os_error(errno.ENOTDIR, dest)
+    if len(srcs) > 1:
+        raise_os_error(errno.ENOTDIR, dest)
     src = srcs[0]
-    if dest.is_file():
-        if src.is_dir():
+    if dest_st:
+        if S_ISDIR(os.stat(str(src)).st_mode):
             raise_os_error(errno.EISDIR, src)
-        else:
-            # overwrite destination
-            shutil.move(to_str(src), to_str(dest))
+        # overwrite destination
+        _move(str(src), str(dest), workers, "replace")
     else:
-        # destination does not exist
-        if dest.exists():
+        # destination does not exist, or is a broken symbolic link
+        _move(str(src), str(dest), workers, "link")
+
+
+# mv_many {{{2
+def mv_many(pairs, overwrite=False):
+    """
+    Rename many files or directories as a single transaction.
+
+    pairs is a collection of (src, dest) pairs.  Unlike mv(), dest is the new
+    name of src even if it is an existing directory.  The plan is validated
+    before anything is renamed: every src must exist, no two items may be
+    given the same dest, and every dest must be on the same filesystem as its
+    src.  A dest that exists and is not itself renamed away by the plan
+    raises FileExistsError unless overwrite is true, in which case it is set
+    aside and removed once all renames succeed.  The renames are ordered so
+    that each dest is vacated before it is needed, and cycles, such as
+    swapping two names, are broken using a temporary name.  If a rename
+    fails, those already performed are undone before the error is raised.
+    """
+    from uuid import uuid4
+
+    def temporary(path):
+        head, tail = os.path.split(path)
+        return os.path.join(head, ".{}.mv-{}".format(tail, uuid4().hex))
+
+    # validate the plan
+    plan = []
+    by_src = {}
+    dests = set()
+    parents = {}
+    for src, dest in pairs:
+        src = os.path.abspath(to_str(src))
+        dest = os.path.abspath(to_str(dest))
+        src_st = os.lstat(src)
+        if src in by_src or dest in dests:
+            raise_os_error(errno.EEXIST, dest if dest in dests else src)
+        dests.add(dest)
+        if src == dest:
+            continue
+        parent = os.path.dirname(dest)
+        if parent not in parents:
+            parents[parent] = os.stat(parent).st_dev
+        if parents[parent] != src_st.st_dev:
+            raise_os_error(errno.EXDEV, dest)
+        by_src[src] = (src, dest)
+        plan.append((src, dest))
+    displaced = []
+    for src, dest in plan:
+        if dest not in by_src and os.path.lexists(dest):
+            if not overwrite:
+                raise_os_error(errno.EEXIST, dest)
+            displaced.append((dest, temporary(dest)))
+
+    # order the renames so each dest is vacated before it is used
+    renames = list(displaced)
+    scheduled = set()
+    for pair in plan:
+        if pair[0] in scheduled:
+            continue
+        chain = [pair]
+        scheduled.add(pair[0])
+        while chain[-1][1] in by_src and chain[-1][1] not in scheduled:
+            chain.append(by_src[chain[-1][1]])
+            scheduled.add(chain[-1][0])
+        if chain[-1][1] == chain[0][0]:
+            # a cycle, move the first item out of the way to break it
+            src, dest = chain[0]
+            temp = temporary(src)
+            renames.append((src, temp))
+            renames.extend(reversed(chain[1:]))
+            renames.append((temp, dest))
+        else:
+            renames.extend(reversed(chain))
+
+    # perform the renames, undoing them if one fails
+    done = []
+    try:
+        for src, dest in renames:
+            os.rename(src, dest)
+            done.append((src, dest))
+    except BaseException:
+        for src, dest in reversed(done):
+            try:
+                os.rename(dest, src)
+            except OSError:
+                pass
+        raise
+    rm(*(temp for dest, temp in displaced))
+
+
+# _move {{{2
+def _move(src, dest, workers, existing):
+    """
+    Move src to dest.
+
+    existing specifies what to do if dest exists: 'replace' replaces it,
+    'link' replaces it only if it is a symbolic link and otherwise raises
+    EEXIST, and 'move' leaves it to shutil.move, which moves src into dest if
+    it is a directory.
+    """
+    try:
+        if existing == "replace":
+            os.rename(src, dest)
+        else:
+            _rename_noreplace(src, dest)
+        return
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            if not os.path.lexists(dest) or existing == "replace":
+                _move_across(src, dest, workers)
+                return
+        elif e.errno not in (errno.EEXIST, errno.ENOTEMPTY, errno.EINVAL):
+            raise
+    # odd cases: an existing destination, a directory moved into itself
+    if existing == "link" and os.path.lexists(dest):
+        if not os.path.islink(dest):
             raise_os_error(errno.EEXIST, dest)
-        shutil.move(to_str(src), to_str(dest))
+    shutil.move(src, dest)
+
+
+# _move_across {{{2
+def _move_across(src, dest, workers):
+    # move between filesystems by copying and then removing the original
+    src_st = os.lstat(src)
+    if S_ISDIR(src_st.st_mode):
+        _copytree(
+            [(src, dest)], _Copier(), workers, symlinks=True, hardlinks=True
+        )
+        rm(src, workers=workers, background=True)
+    elif S_ISREG(src_st.st_mode):
+        _Copier()(src, dest)
+        os.unlink(src)
+    else:
+        shutil.move(src, dest)  # symbolic links and special files
+
+
+# _rename_noreplace {{{2
+_RENAME_NOREPLACE = 1
+_AT_FDCWD = -100
+_renameat2 = []
+
+
+def _rename_noreplace(src, dest):
+    """
+    Rename src to dest, raising FileExistsError if dest exists.
+
+    Uses renameat2 from the C library, which performs the check and the rename
+    as a single atomic operation.  If it is not available, falls back to
+    checking for dest before renaming.
+    """
+    import ctypes
+
+    if not _renameat2:
+        try:
+            renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+            renameat2.argtypes = [
+                ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p,
+                ctypes.c_uint,
+            ]
+            renameat2.restype = ctypes.c_int
+        except (OSError, AttributeError):
+            renameat2 = None
+        _renameat2.append(renameat2)
+    renameat2 = _renameat2[0]
+    if renameat2:
+        if renameat2(
+            _AT_FDCWD, os.fsencode(src), _AT_FDCWD, os.fsencode(dest),
+            _RENAME_NOREPLACE
+        ) == 0:
+            return
+        err = ctypes.get_errno()
+        if err not in (errno.ENOSYS, errno.EINVAL):
+            raise OSError(err, os.strerror(err), src, None, dest)
+        # the kernel or filesystem does not support the flag
+    if os.path.lexists(dest):
+        raise_os_error(errno.EEXIST, dest)
+    os.rename(src, dest)
 
 
 # rm {{{2
-def rm(*paths):
-    "Remove files or directories (equivalent to rm -rf)"
+def rm(*paths, workers=None, background=False):
+    """
+    Remove files or directories (equivalent to rm -rf)
+
+    If workers is greater than 1, directory trees are removed using that many
+    threads.
+
+    If background is true, each directory is renamed to a hidden name in its
+    parent directory (.<name>.rm-<uuid>) and then removed by a background
+    thread, so rm returns almost immediately.  Use rm_wait() to wait for these
+    removals to complete.  Those still pending when the program exits are
+    completed first.  If background is 'detach', the renamed directories are
+    instead removed by detached processes, which neither delay the exit of the
+    program nor are interrupted by it; their errors are not reported.  In
+    either case, hidden directories left in the same parent directory by
+    background removals that were interrupted are also removed.
+    """
     for path in to_paths(paths):
         try:
-            if path.is_dir() and not path.is_symlink():
-                shutil.rmtree(to_str(path))
+            if S_ISDIR(os.lstat(str(path)).st_mode):
+                if background and _reaper.reap(path, workers, background == "detach"):
+                    continue
+                if workers and workers > 1:
+                    _rmtree(path, workers)
+                else:
+                    shutil.rmtree(str(path))
             else:
-                path.unlink()
+                os.unlink(str(path))
         except FileNotFoundError:
             pass
 
 
+# rm_wait {{{2
+def rm_wait(timeout=None):
+    """
+    Wait for the removals started by rm(..., background=True) to complete.
+
+    Returns True if they have all completed, or False if timeout (in seconds)
+    expires first.  Raises the first OSError encountered by the removals, if
+    any.
+    """
+    return _reaper.wait(timeout)
+
+
+# _Reaper {{{2
+class _Reaper(object):
+    # Removes directory trees on a background thread or in detached processes.
+    # The trees are first renamed to a hidden name in the same directory, which
+    # is atomic and assures that the new name is on the same filesystem.  The
+    # first time a directory is used, the trees left in it by removals that
+    # were interrupted, perhaps by this program being killed, are also removed.
+    def __init__(self):
+        self.queue = None
+        self.pending = 0
+        self.errors = []
+        self.condition = threading.Condition()
+        self.created = set()  # the trash made by this process
+        self.swept = set()  # the directories already searched for leftovers
+
+    def reap(self, path, workers, detach=False):
+        # returns False if the directory could not be renamed
+        from uuid import uuid4
+
+        trash = path.parent / ".{}.rm-{}".format(path.name, uuid4().hex)
+        try:
+            os.rename(str(path), str(trash))
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                raise
+            return False
+        with self.condition:
+            self.created.add(str(trash))
+            leftovers = self.leftovers(path.parent)
+        for each in [trash] + leftovers:
+            if detach:
+                self.detach(each)
+            else:
+                self.submit(each, workers)
+        return True
+
+    def leftovers(self, directory):
+        # returns the trash left in directory by interrupted removals
+        key = os.path.abspath(str(directory))
+        if key in self.swept:
+            return []
+        self.swept.add(key)
+        try:
+            with os.scandir(str(directory)) as entries:
+                names = [
+                    e.name for e in entries
+                    if _TRASH_NAME.match(e.name) and _is_dir(e, follow_symlinks=False)
+                ]
+        except OSError:
+            return []
+        found = [directory / name for name in names]
+        return [p for p in found if str(p) not in self.created]
+
+    def detach(self, trash):
+        import subprocess
+
+        # the shell starts rm in the background and exits immediately, so rm
+        # is adopted by init and outlives this process
+        subprocess.run(
+            ["sh", "-c", 'rm -rf -- "$1" &', "sh", str(trash)],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL, start_new_session=True,
+        )
+
+    def submit(self, trash, workers):
+        with self.condition:
+            if self.queue is None:
+                import atexit
+                from queue import Queue
+
+                self.queue = Queue()
+                thread = threading.Thread(target=self.run, name="shlib-rm")
+                thread.daemon = True
+                thread.start()
+                atexit.register(self.wait)
+            self.pending += 1
+        self.queue.put((trash, workers))
+
+    def run(self):
+        while True:
+            trash, workers = self.queue.get()
+            try:
+                rm(trash, workers=workers)
+            except OSError as e:
+                with self.condition:
+                    self.errors.append(e)
+            with self.condition:
+                self.pending -= 1
+                self.condition.notify_all()
+
+    def wait(self, timeout=None):
+        with self.condition:
+            done = self.condition.wait_for(lambda: not self.pending, timeout)
+            errors, self.errors = self.errors, []
+        if errors:
+            raise errors[0]
+        return done
+
+
+_reaper = _Reaper()
+_TRASH_NAME = re.compile(r"\..*\.rm-[0-9a-f]{32}\Z", re.DOTALL)
+
+
+# _rmtree {{{2
+def _rmtree(path, workers):
+    """
+    Remove a directory tree using a pool of threads.
+
+    The tree is processed one level at a time.  Each directory in a level is
+    opened and everything in it other than subdirectories is unlinked relative
+    to its descriptor; the subdirectories form the next level.  Once the tree
+    is exhausted the directories, now empty, are removed from the bottom up.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    flags = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0)
+    flags |= getattr(os, "O_NOFOLLOW", 0)
+
+    def clear(dirpath):
+        # unlink all but the subdirectories, which are returned
+        subdirs = []
+        try:
+            fd = os.open(dirpath, flags)
+        except FileNotFoundError:
+            return subdirs
+        try:
+            with os.scandir(fd) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(os.path.join(dirpath, entry.name))
+                        continue
+                    try:
+                        os.unlink(entry.name, dir_fd=fd)
+                    except FileNotFoundError:
+                        pass
+        finally:
+            os.close(fd)
+        return subdirs
+
+    def rmdir(dirpath):
+        try:
+            os.rmdir(dirpath)
+        except FileNotFoundError:
+            pass
+
+    levels = []
+    level = [str(path)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while level:
+            levels.append(level)
+            level = [d for subdirs in pool.map(clear, level) for d in subdirs]
+        for level in reversed(levels):
+            for _ in pool.map(rmdir, level):
+                pass
+
+
 # ln {{{2
 def ln(src, dest):
     "Create symbolic link."
@@ -222,12 +1278,75 @@ def ln(src, dest):
 
 
 # touch {{{2
-def touch(*paths):
+def touch(*paths, times=None, reference=None, workers=None):
     """
     Touch one or more files. If files do not exist, create them.
+
+    times (tuple):
+        The access and modification times, in seconds since the epoch, given
+        to the files.  The default is the current time.
+    reference (path):
+        The access and modification times are taken from this file.
+    workers (int):
+        If greater than 1, directories are processed concurrently using that
+        many threads.
+
+    The paths are grouped by their directory and each directory is opened
+    once; the files are then touched and created relative to its descriptor.
+    As with Path.touch(), if the times of a file cannot be set, it is opened
+    for writing instead, which raises an error only if that fails too.
     """
+    if reference is not None:
+        st = os.stat(to_str(reference))
+        stamp = dict(ns=(st.st_atime_ns, st.st_mtime_ns))
+    elif times is not None:
+        stamp = dict(times=tuple(times))
+    else:
+        stamp = {}
+
+    groups = {}
     for path in to_paths(paths):
-        path.touch()
+        head, tail = os.path.split(str(path))
+        groups.setdefault(head or ".", []).append(tail)
+
+    relative = os.utime in os.supports_dir_fd and os.open in os.supports_dir_fd
+    flags = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0)
+
+    def touch_group(directory, names):
+        dir_fd = os.open(directory, flags) if relative else None
+        try:
+            for name in names:
+                if not name:
+                    # the root directory has no name within a parent
+                    os.utime(directory, **stamp)
+                    continue
+                path = name if relative else os.path.join(directory, name)
+                try:
+                    os.utime(path, dir_fd=dir_fd, **stamp)
+                    continue
+                except OSError:
+                    pass
+                fd = os.open(
+                    path, os.O_CREAT | os.O_WRONLY, 0o666, dir_fd=dir_fd
+                )
+                try:
+                    if stamp:
+                        os.utime(fd, **stamp)
+                finally:
+                    os.close(fd)
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+
+    if workers and workers > 1 and len(groups) > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in pool.map(touch_group, groups, groups.values()):
+                pass
+    else:
+        for directory, names in groups.items():
+            touch_group(directory, names)
 
 
 # mkdir {{{2
@@ -235,70 +1354,896 @@ def mkdir(*paths):
     """
     Create a directory and all parent directories. Returns without complaint if
     directory already exists.
+
+    The paths are sorted and duplicates removed, so parents are created before
+    their children, and the directories known to exist are remembered, so
+    each new directory costs a single mkdir system call.  Missing parents are
+    created iteratively, so there is no limit on the depth of the paths.
     """
+    known = set()
+    for path in sorted(set(str(p) for p in to_paths(paths))):
+        pending = [path]
+        while pending:
+            path = pending[-1]
+            if path not in known:
+                try:
+                    os.mkdir(path)
+                except FileNotFoundError:
+                    parent = os.path.dirname(path)
+                    if not parent or parent == path:
+                        raise
+                    pending.append(parent)
+                    continue
+                except FileExistsError:
+                    if not os.path.isdir(path):
+                        raise
+                known.add(path)
+            pending.pop()
+
+
+# mount/umount {{{2
+class mount:
+    def __init__(self, path):
+        self.path = to_path(path)
+        self.previously_mounted = is_mounted(self.path)
+        modes = 'sOEW0' if PREFERENCES["use_inform"] else 'soeW0'
+
+        if not self.previously_mounted:
+            Run(["mount", self.path], modes=modes)
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if not self.previously_mounted:
+            umount(self.path)
+
+
+def umount(path):
+    modes = 'sOEW0' if PREFERENCES["use_inform"] else 'soeW0'
+    Run(["umount", path], modes=modes)
+
+
+def is_mounted(path):
+    modes = 'sOEW1' if PREFERENCES["use_inform"] else 'soeW1'
+    return Run(["mountpoint", "-q", path], modes=modes).status == 0
+
+
+# cd {{{2
+class cd:
+    def __init__(self, path):
+        self.starting_dir = cwd()
+        os.chdir(to_str(path))
+
+    # support __enter__ and __exit__ so cd can be called in a with statement.
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        os.chdir(to_str(self.starting_dir))
+
+
+# cwd {{{2
+def cwd():
+    """Return current working directory as a pathlib path"""
+    return Path.cwd()
+
+
+# chmod {{{2
+def chmod(mode, *paths, recursive=False, dir_mode=None, workers=None):
+    """
+    Change the mode bits of one or more file or directory
+
+    mode may be an integer or a symbolic mode as used by the chmod command,
+    such as 'u+rwX,go-w' (if no class is given, 'a' is assumed and the umask is
+    ignored).  dir_mode, if given, is used for directories instead of mode.
+
+    If recursive is true, the contents of directories are changed as well.
+    Symbolic links found within the directories are skipped and modes that
+    would not change are not set.  A directory is changed before its contents
+    unless that would make it unreadable, in which case it is changed after.
+    If workers is greater than 1, the directories are read and the modes set
+    using that many threads.  If a directory cannot be read, the rest of the
+    tree is still changed and then the error is raised.
+    """
+    file_mode = _parse_mode(mode)
+    dir_mode = file_mode if dir_mode is None else _parse_mode(dir_mode)
+    if isinstance(mode, int) and dir_mode is file_mode and not recursive:
+        for path in to_paths(paths):
+            path.chmod(mode)
+        return
+
+    def new_mode(st):
+        # returns the new mode, or None if it is unchanged
+        old = st.st_mode & 0o7777
+        is_dir = S_ISDIR(st.st_mode)
+        new = (dir_mode if is_dir else file_mode)(old, is_dir)
+        return None if new == old else new
+
+    readable = 0o500  # owner must be able to read and search a directory
+
     for path in to_paths(paths):
-        path.mkdir(parents=True, exist_ok=True)
+        root = _PathEntry(path)
+        new = new_mode(root.stat())
+        if not recursive or not root.is_dir():
+            if new is not None:
+                os.chmod(root.path, new)
+            continue
+        deferred = []
+        if new is not None:
+            if new & readable == readable:
+                os.chmod(root.path, new)
+            else:
+                deferred.append((root.path, new))
+        errors = []
+        try:
+            _chmod_tree(path, root, new_mode, deferred, workers, errors.append)
+        finally:
+            for dirpath, new in reversed(deferred):
+                os.chmod(dirpath, new)
+        if errors:
+            raise errors[0]
+
+
+# _chmod_tree {{{2
+def _chmod_tree(path, root, new_mode, deferred, workers, report):
+    """
+    Change the modes of the contents of a directory tree.
+
+    The tree is walked with _walk() and the modes of the entries in each
+    directory are set relative to its descriptor.  Directories are changed
+    as they are found, before they are read, unless the owner would lose the
+    ability to read them, in which case they are added to deferred.  report
+    is called with the error raised by each directory that cannot be read.
+    """
+    readable = 0o500
+
+    def descend(subdir, entry, depth):
+        # change subdirectories before the walk reads them
+        if not _is_dir(entry, follow_symlinks=False):
+            return False
+        try:
+            new = new_mode(entry.stat(follow_symlinks=False))
+        except OSError:
+            return True
+        if new is not None:
+            if new & readable == readable:
+                os.chmod(str(subdir), new)
+            else:
+                deferred.append((str(subdir), new))
+        return True
+
+    def apply(dirpath, dir_fd, changes):
+        for name, new in changes:
+            if dir_fd is None:
+                os.chmod(os.path.join(str(dirpath), name), new)
+            else:
+                os.chmod(name, new, dir_fd=dir_fd)
+
+    pool = None
+    if workers and workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        pool = ThreadPoolExecutor(max_workers=workers)
+    futures = []
+    try:
+        for dirpath, dirent, contents, depth, fd in _walk(
+            path, root, descend, workers=workers, report=report,
+            prestat=bool(pool), with_fd=True,
+        ):
+            changes = []
+            for entry in contents:
+                if entry.is_symlink() or _is_dir(entry, follow_symlinks=False):
+                    continue  # directories are changed by descend
+                try:
+                    new = new_mode(entry.stat(follow_symlinks=False))
+                except FileNotFoundError:
+                    continue
+                if new is not None:
+                    changes.append((entry.name, new))
+            if not changes:
+                continue
+            if pool:
+                futures.append(pool.submit(apply, dirpath, None, changes))
+            else:
+                apply(dirpath, fd, changes)
+    finally:
+        if pool:
+            pool.shutdown(wait=True)
+    for future in futures:
+        future.result()
+
+
+# _parse_mode {{{2
+_MODE_CLAUSE = re.compile(r"([ugoa]*)((?:[-+=](?:[ugo]|[rwxXst]*))+)\Z")
+_MODE_OP = re.compile(r"([-+=])([ugo]|[rwxXst]*)")
+_MODE_CLASSES = dict(u=0o4700, g=0o2070, o=0o1007)
+_MODE_SHIFTS = dict(u=6, g=3, o=0)
+
+
+def _parse_mode(mode):
+    """
+    Convert a mode into a function that returns the new mode bits.
+
+    The function is passed the existing mode bits and whether the path is a
+    directory.  mode is either an integer, which simply replaces the existing
+    bits, or a symbolic mode such as 'u+rwX,go-w'.  Raises ValueError if a
+    symbolic mode is invalid.
+    """
+    if isinstance(mode, int):
+        return lambda old, is_dir: mode
+    clauses = []
+    for clause in mode.split(","):
+        match = _MODE_CLAUSE.match(clause)
+        if not match:
+            raise ValueError("{}: invalid mode.".format(mode))
+        who = match.group(1).replace("a", "ugo") or "ugo"
+        clauses.append((who, _MODE_OP.findall(match.group(2))))
+
+    def apply(old, is_dir):
+        new = old
+        for who, ops in clauses:
+            for op, perms in ops:
+                if perms in ("u", "g", "o"):
+                    # copy the permissions of another class as they stand
+                    # after the preceding clauses, as GNU chmod does
+                    rwx = (new >> _MODE_SHIFTS[perms]) & 0o7
+                    bits = sum(rwx << _MODE_SHIFTS[c] for c in who)
+                else:
+                    rwx = 0
+                    rwx |= 0o4 if "r" in perms else 0
+                    rwx |= 0o2 if "w" in perms else 0
+                    if "x" in perms or "X" in perms and (is_dir or new & 0o111):
+                        rwx |= 0o1
+                    bits = sum(rwx << _MODE_SHIFTS[c] for c in who)
+                    if "s" in perms:
+                        bits |= 0o4000 if "u" in who else 0
+                        bits |= 0o2000 if "g" in who else 0
+                    if "t" in perms and "o" in who:
+                        bits |= 0o1000
+                if op == "+":
+                    new |= bits
+                elif op == "-":
+                    new &= ~bits
+                else:
+                    mask = sum(_MODE_CLASSES[c] for c in who)
+                    new = (new & ~mask) | bits
+        return new
+
+    return apply
+
+
+# getmod {{{2
+def getmod(path):
+    "Return the permission bits for a file or directory"
+    return os.stat(str(path)).st_mode & 0o777
+
+
+# stat_many {{{2
+_STAT_CHUNK = 256  # the number of paths stat'ed by a worker at a time
+
+
+def stat_many(paths, workers=None, report=None, follow_symlinks=True):
+    """
+    Return the status of many paths as a StatArrays.
+
+    paths may be any iterable of paths, including the generators returned by
+    ls() and leaves(), in which case the directories are walked as the paths
+    are stat'ed.  If workers is greater than 1, the paths are stat'ed in
+    chunks using that many threads, so the latency of each call (on network
+    filesystems for example) overlaps with the others.  The results are in
+    the same order as the paths.
+
+    If a path cannot be stat'ed, the OSError is raised, unless report is
+    given, in which case report is called with the error and the path is
+    given a mode of 0 along with the rest of its values.
+    """
+    stat = os.stat if follow_symlinks else os.lstat
+    result = StatArrays()
+
+    def stat_chunk(chunk):
+        statuses = []
+        for path in chunk:
+            try:
+                statuses.append(stat(os.fspath(path)))
+            except OSError as e:
+                statuses.append(e)
+        return chunk, statuses
+
+    def gather(chunk, statuses):
+        for path, st in zip(chunk, statuses):
+            if isinstance(st, OSError):
+                if report is None:
+                    raise st
+                report(st)
+                st = None
+            result.append(path, st)
+
+    paths = iter(paths)
+    chunks = iter(lambda: list(itertools.islice(paths, _STAT_CHUNK)), [])
+    if not workers or workers <= 1:
+        for chunk in chunks:
+            gather(*stat_chunk(chunk))
+        return result
+
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # limit the chunks in flight so the paths are consumed as needed
+        futures = deque()
+        try:
+            for chunk in chunks:
+                futures.append(pool.submit(stat_chunk, chunk))
+                if len(futures) >= 2 * workers:
+                    gather(*futures.popleft().result())
+            while futures:
+                gather(*futures.popleft().result())
+        finally:
+            for future in futures:
+                future.cancel()
+    return result
+
+
+# getmod_many {{{2
+def getmod_many(paths, workers=None, report=None):
+    """
+    Return the permission bits of many paths as an array.
+
+    The bits are in the same order as the paths.  The arguments are the same
+    as those of stat_many(); the bits of paths that could not be stat'ed when
+    report is given are 0.
+    """
+    from array import array
+
+    modes = stat_many(paths, workers, report).mode
+    return array("H", (mode & 0o777 for mode in modes))
+
+
+# StatArrays {{{2
+class StatArrays(object):
+    """
+    The status of many paths, held in parallel arrays.
+
+    Returned by stat_many().  Element i of each array holds a value from the
+    status of paths[i].  A mode of 0 indicates that the path could not be
+    stat'ed.
+
+    Attributes:
+        paths (list): the paths, as given.
+        mode (array of int): the file type and permission bits.
+        uid (array of int): the user ID of the owner.
+        gid (array of int): the group ID of the owner.
+        size (array of int): the size in bytes.
+        mtime (array of float): the modification time in seconds since the epoch.
+    """
+
+    __slots__ = ("paths", "mode", "uid", "gid", "size", "mtime")
+
+    def __init__(self):
+        from array import array
+
+        self.paths = []
+        self.mode = array("L")
+        self.uid = array("L")
+        self.gid = array("L")
+        self.size = array("q")
+        self.mtime = array("d")
+
+    def append(self, path, st):
+        # st is None if the path could not be stat'ed
+        self.paths.append(path)
+        if st is None:
+            for column in (self.mode, self.uid, self.gid, self.size, self.mtime):
+                column.append(0)
+            return
+        self.mode.append(st.st_mode)
+        self.uid.append(st.st_uid)
+        self.gid.append(st.st_gid)
+        self.size.append(st.st_size)
+        self.mtime.append(st.st_mtime)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __repr__(self):
+        return "{}({} paths)".format(self.__class__.__name__, len(self.paths))
+
+
+# StatRecord {{{2
+class StatRecord(object):
+    """
+    A path along with its size, modification time, mode and inode number.
+
+    Returned by leaves() and ls() when with_stat is true.  The values come from
+    the status gathered while scanning the directory, so no further system
+    calls are needed to access them.  May be used wherever a path is expected.
+    """
+
+    __slots__ = ("path", "size", "mtime", "mode", "inode")
+
+    def __init__(self, path, st):
+        self.path = path
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.mode = st.st_mode
+        self.inode = st.st_ino
+
+    def __fspath__(self):
+        return str(self.path)
+
+    def __str__(self):
+        return str(self.path)
+
+    def __repr__(self):
+        return "{}({!r}, size={}, mtime={}, mode=0o{:o}, inode={})".format(
+            self.__class__.__name__, str(self.path), self.size, self.mtime,
+            self.mode, self.inode,
+        )
+
+
+# _stat_record {{{2
+def _stat_record(path, entry):
+    # returns None if the path has vanished; a broken symlink describes itself
+    try:
+        return StatRecord(path, entry.stat())
+    except OSError:
+        try:
+            return StatRecord(path, entry.stat(follow_symlinks=False))
+        except OSError:
+            return None
+
+
+# _PathEntry {{{2
+class _PathEntry(object):
+    # Provides the part of the os.DirEntry interface used by ls() for paths that
+    # were not found by scanning a directory. The result of stat is cached so
+    # each of these paths is stat'ed at most once.
+    __slots__ = ("path", "name", "_stat")
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.name = os.path.basename(self.path)
+        self._stat = None
+
+    def stat(self, follow_symlinks=True):
+        if not follow_symlinks:
+            return os.lstat(self.path)
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self, follow_symlinks=True):
+        if not follow_symlinks and os.path.islink(self.path):
+            return False
+        return S_ISDIR(self.stat().st_mode)
+
+    def is_file(self):
+        return S_ISREG(self.stat().st_mode)
+
+
+# _is_dir, _is_file, _is_socket {{{2
+# Type tests for directory entries. These use the file type returned by the
+# operating system when the directory was scanned; they only stat the path if
+# the filesystem did not provide the type (DT_UNKNOWN).
+def _is_dir(entry, follow_symlinks=True):
+    try:
+        return entry.is_dir(follow_symlinks=follow_symlinks)
+    except OSError:
+        return False
+
+
+def _is_file(entry):
+    try:
+        return entry.is_file()
+    except OSError:
+        return False
+
+
+def _is_socket(entry):
+    # the file type of a directory entry does not distinguish sockets, so stat
+    try:
+        return S_ISSOCK(entry.stat().st_mode)
+    except OSError:
+        return False
+
+
+# _scandir {{{2
+def _scandir(path):
+    # return the entries in a directory, unreadable directories are empty
+    try:
+        with os.scandir(str(path)) as entries:
+            return list(entries)
+    except OSError:
+        return []
+
+
+# _walk {{{2
+def _walk(
+    path, entry, descend, entries=None, workers=None, ordered=False, report=None,
+    follow_symlinks=False, prestat=False, with_fd=False,
+):
+    """
+    Yield (dirpath, entry, entries, depth) for path and the directories below it.
+
+    path is a directory, entry is its os.DirEntry (or _PathEntry) and entries
+    are its contents, if already known.  descend is a function that is passed
+    the path, entry and depth of each directory found, it returns True if that
+    directory should be visited.  The depth of path is 0.
+
+    The walk is iterative, so it is not limited by the depth of the tree.
+    Without workers, each directory is opened relative to a descriptor for its
+    parent, so long paths are not resolved over and over.  The descriptor is
+    open while the directory is being yielded, and the names of the entries
+    must be joined to dirpath to form their paths.  If with_fd is true, the
+    descriptor is yielded as a fifth value; it is None for directories that
+    are read by path, which includes all of them when using workers.
+
+    If follow_symlinks is true, directories reached through symbolic links are
+    visited, except those that are also one of their own ancestors, which
+    protects against symbolic link loops (as with find -L).  A directory that
+    is reachable by several paths is visited once for each of them.  Otherwise
+    symbolic links to directories are not opened even if descend returns True
+    for them.
+
+    If workers is greater than 1, directories are read concurrently using that
+    many threads.  The directories are then yielded as they are read unless
+    ordered is true, in which case they are yielded in the same order as they
+    would be if workers were not given.  If prestat is true, the worker threads
+    also fetch the status of each entry, which os.DirEntry caches.  report is
+    called, from the thread that is iterating, with any OSError raised when
+    reading a directory.
+    """
+    def identify(target):
+        # returns the device and inode of a directory, which are only needed
+        # to detect loops when following symbolic links
+        if not follow_symlinks:
+            return None
+        st = os.stat(target)
+        return st.st_dev, st.st_ino
+
+    def scan(dirpath, ancestors):
+        # returns the contents, the error and the ancestors of the
+        # subdirectories, the contents are None if the directory is in a loop
+        try:
+            key = identify(str(dirpath))
+            if key in ancestors:
+                return None, None, ancestors
+            with os.scandir(str(dirpath)) as contents:
+                contents = list(contents)
+        except OSError as e:
+            return [], e, ancestors
+        if prestat:
+            for each in contents:
+                try:
+                    each.stat()
+                except OSError:
+                    pass
+        return contents, None, ancestors | {key} if key else ancestors
+
+    def subdirs(dirpath, contents, depth):
+        found = []
+        for each in contents:
+            subdir = dirpath / each.name
+            if descend(subdir, each, depth + 1):
+                found.append((subdir, each, depth + 1))
+        return found
+
+    def visit(dirpath, contents, error):
+        if error and report:
+            report(error)
+        return contents
+
+    if not workers or workers <= 1:
+        use_fds = os.open in os.supports_dir_fd and os.scandir in os.supports_fd
+        flags = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0)
+        nofollow = 0 if follow_symlinks else getattr(os, "O_NOFOLLOW", 0)
+
+        def opendir(dirpath, name, parent_fd, depth):
+            # open a directory relative to its parent, returns None if it must
+            # be read by path instead; the starting directory is always followed
+            if not use_fds or depth >= MAX_DIR_FDS:
+                # a descriptor is held for each level, so limit their number
+                return None
+            try:
+                if parent_fd is None:
+                    return os.open(str(dirpath), flags | (nofollow if depth else 0))
+                return os.open(name, flags | nofollow, dir_fd=parent_fd)
+            except OSError as e:
+                if e.errno == errno.EMFILE:
+                    # tree is too deep to hold a descriptor for every level
+                    return None
+                raise
+
+        # each frame holds a descriptor for a directory (None if it is read by
+        # path), the subdirectories that remain to be visited and the device
+        # and inode of the directory, which are in ancestors while it is open
+        ancestors = set()
+        stack = [(None, iter([(path, entry, 0)]), None)]
+        try:
+            while stack:
+                parent_fd, children, parent_key = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    stack.pop()
+                    ancestors.discard(parent_key)
+                    if parent_fd is not None:
+                        os.close(parent_fd)
+                    continue
+                dirpath, dirent, depth = child
+                fd = key = None
+                try:
+                    if depth == 0 and entries is not None:
+                        contents = entries
+                    else:
+                        fd = opendir(dirpath, dirent.name, parent_fd, depth)
+                        contents = None
+                    key = identify(str(dirpath) if fd is None else fd)
+                    if key in ancestors:
+                        # a symbolic link loop
+                        if fd is not None:
+                            os.close(fd)
+                        continue
+                    if contents is None:
+                        with os.scandir(str(dirpath) if fd is None else fd) as it:
+                            contents = list(it)
+                except OSError as e:
+                    if fd is not None:
+                        os.close(fd)
+                        fd = None
+                    visit(dirpath, [], OSError(e.errno, e.strerror, str(dirpath)))
+                    contents = []
+                    key = None
+                if key is not None:
+                    ancestors.add(key)
+                stack.append((fd, None, key))
+                yield (dirpath, dirent, contents, depth) + ((fd,) if with_fd else ())
+                stack[-1] = (fd, iter(subdirs(dirpath, contents, depth)), key)
+        finally:
+            for fd, _, _ in stack:
+                if fd is not None:
+                    os.close(fd)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    from queue import Queue
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    outstanding = set()
+    pending = []  # reads in the order they are to be yielded, if ordered
+    finished = Queue()  # reads in the order they complete, if not ordered
+
+    def submit(dirpath, dirent, depth, ancestors):
+        # ancestors holds the devices and inodes of the directories above
+        future = pool.submit(scan, dirpath, ancestors)
+        outstanding.add(future)
+        if ordered:
+            pending.append((future, dirpath, dirent, depth))
+        else:
+            future.add_done_callback(
+                lambda f: finished.put((f, dirpath, dirent, depth))
+            )
 
+    try:
+        if entries is None:
+            submit(path, entry, 0, frozenset())
+        else:
+            try:
+                key = identify(str(path))
+            except OSError:
+                key = None
+            ancestors = frozenset([key] if key else [])
+            yield (path, entry, entries, 0) + ((None,) if with_fd else ())
+            for each in reversed(subdirs(path, entries, 0)):
+                submit(*each, ancestors)
+        while outstanding:
+            # when ordered, this is depth first as it is without workers, but
+            # all of the known directories are being read in the background
+            future, dirpath, dirent, depth = (
+                pending.pop() if ordered else finished.get()
+            )
+            outstanding.discard(future)
+            contents, error, ancestors = future.result()
+            contents = visit(dirpath, contents, error)
+            if contents is None:
+                # a symbolic link loop
+                continue
+            yield (dirpath, dirent, contents, depth) + ((None,) if with_fd else ())
+            for each in reversed(subdirs(dirpath, contents, depth)):
+                submit(*each, ancestors)
+    finally:
+        for future in outstanding:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+
+# _translate_glob {{{2
+def _translate_glob(part):
+    # translate one component of a glob pattern into a regular expression
+    # (like fnmatch.translate(), but wildcards do not match /)
+    i, n = 0, len(part)
+    regex = []
+    while i < n:
+        c = part[i]
+        i += 1
+        if c == "*":
+            regex.append("[^/]*")
+        elif c == "?":
+            regex.append("[^/]")
+        elif c == "[":
+            j = i
+            if j < n and part[j] == "!":
+                j += 1
+            if j < n and part[j] == "]":
+                j += 1
+            while j < n and part[j] != "]":
+                j += 1
+            if j >= n:
+                regex.append("\\[")
+            else:
+                chars = part[i:j].replace("\\", "\\\\")
+                # escape the characters that may form nested sets or set
+                # operations in future versions of re, as fnmatch does
+                chars = re.sub(r"([&~|\[])", r"\\\1", chars)
+                i = j + 1
+                if chars[0] == "!":
+                    chars = "^" + chars[1:]
+                elif chars[0] == "^":
+                    chars = "\\" + chars
+                regex.append("[%s]" % chars)
+        else:
+            regex.append(re.escape(c))
+    return "".join(regex)
 
-# mount/umount {{{2
-class mount:
-    def __init__(self, path):
-        self.path = to_path(path)
-        self.previously_mounted = is_mounted(self.path)
-        modes = 'sOEW0' if PREFERENCES["use_inform"] else 'soeW0'
 
-        if not self.previously_mounted:
-            Run(["mount", self.path], modes=modes)
+# _compile_glob {{{2
+def _is_wildcard(part):
+    return "*" in part or "?" in part or "[" in part
 
-    def __enter__(self):
-        pass
 
-    def __exit__(self, exc_type, exc_value, exc_traceback):
-        if not self.previously_mounted:
-            umount(self.path)
+def _compile_glob(pattern):
+    # split a glob pattern into its components, compiling those with wildcards
+    pattern = Path(pattern)
+    if pattern.anchor:
+        raise NotImplementedError("Non-relative patterns are unsupported")
+    if not pattern.parts:
+        raise ValueError("Unacceptable pattern: {!r}".format(str(pattern)))
+    return [
+        re.compile(_translate_glob(part) + r"\Z")
+        if part != "**" and _is_wildcard(part)
+        else part
+        for part in pattern.parts
+    ]
 
 
-def umount(path):
-    modes = 'sOEW0' if PREFERENCES["use_inform"] else 'soeW0'
-    Run(["umount", path], modes=modes)
+# _compile_match {{{2
+def _compile_match(patterns):
+    """
+    Compile glob patterns into a function that tests a path against them.
 
+    The function returns True if the path matches any of the patterns.  As with
+    Path.match(), relative patterns are matched from the right and absolute
+    patterns must match the entire path.  The patterns are combined into a
+    single regular expression, so the cost of testing a path does not grow with
+    the number of patterns.  Returns None if there are no patterns.
+    """
+    alternatives = []
+    for pattern in patterns:
+        pattern = Path(pattern)
+        if not pattern.parts:
+            raise ValueError("empty pattern")
+        if pattern.anchor:
+            components = pattern.parts[1:]
+            prefix = r"\A" + re.escape(pattern.anchor)
+        else:
+            components = pattern.parts
+            prefix = r"(?:\A|/)"
+        regex = "/".join(_translate_glob(c) for c in components)
+        alternatives.append(prefix + regex + r"\Z")
+    if not alternatives:
+        return None
+    regex = re.compile("|".join(alternatives))
 
-def is_mounted(path):
-    modes = 'sOEW1' if PREFERENCES["use_inform"] else 'soeW1'
-    return Run(["mountpoint", "-q", path], modes=modes).status == 0
+    def match(path):
+        path = str(path)
+        # '.' has no components, and so matches no pattern
+        return path != "." and bool(regex.search(path))
 
+    return match
 
-# cd {{{2
-class cd:
-    def __init__(self, path):
-        self.starting_dir = cwd()
-        os.chdir(to_str(path))
 
-    # support __enter__ and __exit__ so cd can be called in a with statement.
-    def __enter__(self):
-        pass
+# _Glob {{{2
+class _Glob(object):
+    """
+    Finds the items below a directory that match the components of a pattern.
 
-    def __exit__(self, exc_type, exc_value, exc_traceback):
-        os.chdir(to_str(self.starting_dir))
+    Emulates Path.glob(), but reuses the file types returned when scanning
+    directories.
 
+    prune is a function that is passed the path and entry of a directory found
+    by a wildcard, if it returns True the directory is not descended into.
+    max_depth is the maximum depth, relative to the original directory, of the
+    returned paths.  workers, ordered and prestat are passed to _walk() when
+    searching recursively.
+    """
 
-# cwd {{{2
-def cwd():
-    """Return current working directory as a pathlib path"""
-    return Path.cwd()
+    def __init__(
+        self, prune=None, max_depth=None, workers=None, ordered=False,
+        prestat=False,
+    ):
+        self.prune = prune
+        self.max_depth = max_depth
+        self.workers = workers
+        self.ordered = ordered
+        self.prestat = prestat
 
+    def too_deep(self, depth):
+        return self.max_depth is not None and depth > self.max_depth
 
-# chmod {{{2
-def chmod(mode, *paths):
-    "Change the mode bits of one or more file or directory"
-    for path in to_paths(paths):
-        path.chmod(mode)
+    def pruned(self, path, entry):
+        return bool(self.prune and self.prune(path, entry))
 
+    def glob(self, path, entry, parts, entries=None, depth=0):
+        """
+        Yield (path, entry) pairs for the items below path that match parts.
 
-# getmod {{{2
-def getmod(path):
-    "Return the permission bits for a file or directory"
-    return os.stat(str(path)).st_mode & 0o777
+        path is a directory and entry is its os.DirEntry (or _PathEntry).  parts
+        are the compiled components of a glob pattern.  entries are the
+        contents of path, if already known.  depth is the depth of path.
+        """
+        part, rest = parts[0], parts[1:]
+        fixed = sum(1 for p in parts if p != "**")
+        if self.too_deep(depth + fixed):
+            return
+        if part == "**":
+            # this directory and every directory below it, does not follow
+            # symlinks
+            if not _is_dir(entry):
+                return
+
+            def descend(subdir, each, level):
+                if self.too_deep(depth + level + fixed):
+                    return False
+                if not _is_dir(each, follow_symlinks=False):
+                    return False
+                return not self.pruned(subdir, each)
+
+            dirs = _walk(
+                path, entry, descend, entries, self.workers, self.ordered,
+                prestat=self.prestat,
+            )
+            for dirpath, dirent, contents, level in dirs:
+                if rest:
+                    found = self.glob(
+                        dirpath, dirent, rest, contents, depth + level
+                    )
+                    for each in found:
+                        yield each
+                else:
+                    yield dirpath, dirent
+        elif is_str(part):
+            child = path / part
+            child_entry = _PathEntry(child)
+            if rest:
+                for each in self.glob(child, child_entry, rest, None, depth + 1):
+                    yield each
+            else:
+                try:
+                    child_entry.stat()
+                    yield child, child_entry
+                except OSError:
+                    pass
+        else:
+            if entries is None:
+                entries = _scandir(path)
+            for each in entries:
+                if part.match(each.name):
+                    child = path / each.name
+                    if not rest:
+                        yield child, each
+                    elif _is_dir(each) and not self.pruned(child, each):
+                        for p in self.glob(child, each, rest, None, depth + 1):
+                            yield p
 
 
 # ls {{{2
@@ -316,23 +2261,42 @@ def ls(*paths, **kwargs):
     Keyword arguments:
         select:
             A returned path will match this glob string, use **/* to enable
-            recursion.
+            recursion.  May also be a list of glob strings, in which case
+            a returned path will match at least one of them.
         reject:
             A returned path will not match this glob string.  The glob string is
             matched from the right (see pathlib match function).  If an absolute
-            path is given the entire path must match.
+            path is given the entire path must match.  May also be a list of
+            glob strings, in which case a returned path will match none of them.
         only:
             Specifies the type of returned paths, choose from 'file', 'dir' or 
             'socket'.
         hidden (bool):
             Specifies whether hidden files should be returned, if not given
             hidden files are returned if select string starts with '.'.
-
-    KSK: it is a bit weird that I allow paths to be a list, but not select or
-    reject. It would be nice to pass lists to both of those.
+        prune (bool):
+            If true, directories that are rejected, or that are hidden when
+            hidden files are not being returned, are not descended into when
+            recursing.  Otherwise they are searched, though they are not
+            returned themselves.
+        max_depth (int):
+            The maximum depth of the returned paths relative to the path being
+            listed; the items in the directory have a depth of 1.  Directories
+            that can only contain deeper paths are not searched.
+        workers (int):
+            If greater than 1, a recursive search reads directories
+            concurrently using this many threads.  This helps most on network
+            filesystems, where the latency of each read dominates.
+        ordered (bool):
+            If true, paths found by a concurrent search are returned in the
+            same order as they would be without workers, otherwise they are
+            returned as they are found.
+        with_stat (bool):
+            If true, StatRecords are returned rather than paths.  These
+            include the size, modification time, mode and inode of each path.
 
     Returns:
-        path generator: iterates through filtered paths
+        path generator: iterates through filtered paths (or their StatRecords)
 
     >>> from shlib import *
 
@@ -351,38 +2315,72 @@ def ls(*paths, **kwargs):
 
     """
     select = kwargs.get("select", "*")
-    reject = kwargs.get("reject", "\0")
-        # KSK: I have used '\0' as the default reject pattern because using ''
-        # generates an exception. I put in an enhancement request to the pathlib
-        # team to fix this, but it was rejected.
+    reject = kwargs.get("reject", [])
     only = kwargs.get("only")
     hidden = kwargs.get("hidden")
-
-    def acceptable(path):
-        if only == "file" and not path.is_file():
+    prune = kwargs.get("prune", False)
+    max_depth = kwargs.get("max_depth")
+    workers = kwargs.get("workers")
+    ordered = kwargs.get("ordered", False)
+    with_stat = kwargs.get("with_stat", False)
+
+    def acceptable(path, entry):
+        if only == "file" and not _is_file(entry):
             return False
-        if only == "dir" and not path.is_dir():
+        if only == "dir" and not _is_dir(entry):
             return False
-        if only == "socket" and not path.is_socket():
+        if only == "socket" and not _is_socket(entry):
             return False
         if not retain_hidden and path.name.startswith("."):
             return False
-        if path.match(reject):
+        if rejected and rejected(path):
             return False
         return True
 
-    select = to_str(select)
-    retain_hidden = select.startswith(".") if hidden is None else hidden
+    def pruned(path, entry):
+        if not retain_hidden and path.name.startswith("."):
+            return True
+        return bool(rejected and rejected(path))
+
+    # compile the patterns once, they are used for every path
+    selects = [to_str(s) for s in (select if is_collection(select) else [select])]
+    rejects = [to_str(r) for r in (reject if is_collection(reject) else [reject])]
+    if hidden is None:
+        retain_hidden = any(s.startswith(".") for s in selects)
+    else:
+        retain_hidden = hidden
+    selected = _compile_match(selects)
+    rejected = _compile_match(rejects)
+    globs = [_compile_glob(s) for s in selects]
+    globber = _Glob(
+        pruned if prune else None, max_depth, workers, ordered, with_stat
+    )
+
+    def found(path, entry):
+        return _stat_record(path, entry) if with_stat else path
+
+    repeats = len(globs) > 1 or any(g.count("**") > 1 for g in globs)
     paths = paths if paths else ["."]
     for path in to_paths(paths):
-        if path.is_file() and acceptable(path):
-            if path.match(select):
-                yield path
-        elif path.is_dir():
-            for each in path.glob(select):
-                # glob() supports recursion so use it rather than iterdir()
-                if acceptable(each):
-                    yield each
+        entry = _PathEntry(path)
+        if _is_file(entry) and acceptable(path, entry):
+            if selected(path):
+                yield found(path, entry)
+        elif _is_dir(entry):
+            # glob() supports recursion so use it rather than scanning here
+            seen = set()
+            for parts in globs:
+                for each, each_entry in globber.glob(path, entry, parts):
+                    if repeats:
+                        # a path may match more than one pattern or '**' may be
+                        # given more than once, so suppress duplicates
+                        if each in seen:
+                            continue
+                        seen.add(each)
+                    if acceptable(each, each_entry):
+                        result = found(each, each_entry)
+                        if result is not None:
+                            yield result
 
 
 # lsd {{{2
@@ -442,24 +2440,11 @@ def lsf(*args, **kwargs):
 
 
 # Path list functions (leaves, cartesian_product, brace_expand, etc.) {{{1
-# _leaves()  {{{2
-def _leaves(path, hidden, report):
-    try:
-        if path.is_file():
-            if hidden or not path.name.startswith("."):
-                yield path
-        elif path.is_dir():
-            for each in path.iterdir():
-                if hidden or not each.name.startswith("."):
-                    for p in _leaves(each, hidden, report):
-                        yield p
-    except OSError as e:
-        if report:
-            report(e)
-
-
 # leaves()  {{{2
-def leaves(path, hidden=False, report=None):
+def leaves(
+    path, hidden=False, report=None, workers=None, ordered=False,
+    follow_symlinks=True, with_stat=False,
+):
     """
     Recursively descend into a directory yielding all of the files.
 
@@ -470,10 +2455,59 @@ def leaves(path, hidden=False, report=None):
     report (func):
         Function to call if an error is detected. Takes one argument, the
         exception, which will only be an OSError.  If not specified, no errors
-        are reported.
+        are reported.  It is always called from the thread iterating over
+        leaves, even if the error occurred in a worker thread.
+    workers (int):
+        If greater than 1, directories are read concurrently using this many
+        threads.
+    ordered (bool):
+        If true, files found when using workers are yielded in the same order
+        as they would be without workers, otherwise they are yielded as they
+        are found.
+    follow_symlinks (bool):
+        Descend into symbolic links to directories.  A link to one of its own
+        ancestors is not followed, so symbolic link loops are avoided.
+    with_stat (bool):
+        Yield StatRecords rather than paths.  These include the size,
+        modification time, mode and inode of each file, taken from the status
+        gathered during the walk.
+
+    The walk is iterative, so very deep trees are not a problem.
     """
-    for each in _leaves(Path(path), hidden, report):
-        yield each
+    path = Path(path)
+    entry = _PathEntry(path)
+    try:
+        if entry.is_file():
+            if hidden or not path.name.startswith("."):
+                yield _stat_record(path, entry) if with_stat else path
+            return
+        if not entry.is_dir():
+            return
+    except OSError as e:
+        # as with Path.is_file(), a path that does not exist is not an error
+        if report and e.errno not in (errno.ENOENT, errno.ENOTDIR, errno.ELOOP):
+            report(e)
+        return
+
+    def descend(subdir, each, depth):
+        if not hidden and each.name.startswith("."):
+            return False
+        return _is_dir(each, follow_symlinks=follow_symlinks)
+
+    dirs = _walk(
+        path, entry, descend, None, workers, ordered, report, follow_symlinks,
+        with_stat,
+    )
+    for dirpath, _, entries, _ in dirs:
+        for each in entries:
+            if hidden or not each.name.startswith("."):
+                if _is_file(each):
+                    if with_stat:
+                        record = _stat_record(dirpath / each.name, each)
+                        if record:
+                            yield record
+                    else:
+                        yield dirpath / each.name
 
 
 # cartesian_product()  {{{2
@@ -502,7 +2536,7 @@ def brace_expand(pattern):
         yield to_path(path)
 
 
-# Execution classes and functions (Cmd, Run, Sh, Start, run, bg, shbg, which) {{{1
+# Execution classes and functions (Cmd, Run, Sh, Start, AsyncCmd, run, bg, shbg, which) {{{1
 # Command class {{{2
 class Cmd(object):
     # description {{{3
@@ -596,21 +2630,20 @@ class Cmd(object):
         subprocess.Popen.
 
         Returns exit status if wait_for_termination is True.
-        If wait_for_termination is False, you must call wait(), otherwise stdin
-        is not be applied.  If you don't want to wait, call start() instead.
+        If wait_for_termination is False, you must call wait() or iterate
+        through iter_lines(), otherwise stdin is not be applied.  If you don't
+        want to wait, call start() instead.
         """
+        self._spawn(stdin, **kwargs)
+        if self.wait_for_termination:
+            return self.wait()
+
+    # _spawn {{{3
+    def _spawn(self, stdin=None, **kwargs):
         self.stdin = stdin
         import subprocess
 
-        if is_str(self.cmd):
-            cmd = self.cmd if self.use_shell else split_cmd(self.cmd)
-        else:
-            # cannot use to_str() because it can change some arguments when not intended.
-            # this is particularly problematic the duplicity arguments in embalm
-            cmd = [str(c) for c in self.cmd]
-        if _use_log(self.log):
-            from inform import indent, log
-            log(f"running:\n{indent(render_command(cmd, option_args=self.option_args))}")
+        cmd = self._prepare()
 
         # indicate streams to intercept
         streams = {}
@@ -639,11 +2672,23 @@ class Cmd(object):
                 raise
         self.running = True
 
-        # store needed information and wait for termination if desired
+        # store needed information
         self.pid = process.pid
         self.process = process
-        if self.wait_for_termination:
-            return self.wait()
+
+    # _prepare {{{3
+    def _prepare(self):
+        # returns the command in the form expected by Popen, logs it if desired
+        if is_str(self.cmd):
+            cmd = self.cmd if self.use_shell else split_cmd(self.cmd)
+        else:
+            # cannot use to_str() because it can change some arguments when not intended.
+            # this is particularly problematic the duplicity arguments in embalm
+            cmd = [str(c) for c in self.cmd]
+        if _use_log(self.log):
+            from inform import indent, log
+            log(f"running:\n{indent(render_command(cmd, option_args=self.option_args))}")
+        return cmd
 
     # start {{{3
     def start(self, stdin=None):
@@ -717,9 +2762,96 @@ class Cmd(object):
 
         stdin = self.stdin if self.stdin else ""
         stdout, stderr = process.communicate(stdin.encode(self.encoding))
+        return self._finish(stdout, stderr, process.returncode)
+
+    # iter_lines {{{3
+    def iter_lines(self, stream="stdout"):
+        """
+        Iterate through the lines the command writes to stream.
+
+        stream is either 'stdout' or 'stderr' and it must be captured.  The
+        command is run if it has not been run already.  Lines are yielded with
+        their line terminators as they are read from the pipe, so the output
+        is never held in memory in its entirety.  Any other captured stream is
+        accumulated as it arrives, so the command cannot stall writing to it,
+        and once the lines are exhausted it is available as an attribute and
+        the exit status is checked as in wait().
+
+        If the iteration is abandoned before the lines are exhausted, the pipes
+        are closed and the command is killed, its exit status is recorded but
+        not checked.
+        """
+        import selectors
+        from select import PIPE_BUF
+
+        if getattr(self, "process", None) is None:
+            self._spawn()
+        process = self.process
+        pipes = dict(stdout=process.stdout, stderr=process.stderr)
+        if pipes.get(stream) is None:
+            raise ValueError(f"{stream}: not captured.")
+
+        selector = selectors.DefaultSelector()
+        for name, pipe in pipes.items():
+            if pipe is not None:
+                selector.register(pipe, selectors.EVENT_READ, name)
+        if process.stdin is not None:
+            stdin = self.stdin.encode(self.encoding) if self.stdin else b""
+            if stdin:
+                selector.register(process.stdin, selectors.EVENT_WRITE)
+            else:
+                process.stdin.close()
+        splitter = _LineSplitter(self.encoding)
+        buffered = []
+        offset = 0
+        exhausted = False
+        try:
+            while selector.get_map():
+                for key, events in selector.select():
+                    if key.fileobj is process.stdin:
+                        chunk = stdin[offset:offset + PIPE_BUF]
+                        try:
+                            offset += os.write(key.fd, chunk)
+                        except BrokenPipeError:
+                            offset = len(stdin)
+                        if offset >= len(stdin):
+                            selector.unregister(key.fileobj)
+                            key.fileobj.close()
+                        continue
+                    data = os.read(key.fd, _BUFFER_SIZE)
+                    if not data:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                    if key.data == stream:
+                        yield from splitter.feed(data)
+                    else:
+                        buffered.append(data)
+            exhausted = True
+        finally:
+            selector.close()
+            if not exhausted:
+                # otherwise the command could be left blocked on a full pipe
+                for pipe in (process.stdin, process.stdout, process.stderr):
+                    if pipe is not None:
+                        pipe.close()
+                self.kill()
+                self.status = process.returncode
+                self.running = False
+        status = process.wait()
+
+        output = {
+            name: None if name == stream or pipe is None else b"".join(buffered)
+            for name, pipe in pipes.items()
+        }
+        self._finish(output["stdout"], output["stderr"], status)
+
+    # _finish {{{3
+    def _finish(self, stdout, stderr, status):
+        # record the output and exit status of the command, which is returned
+        # if it is acceptable, otherwise an exception is raised
         self.stdout = None if stdout is None else stdout.decode(self.encoding)
         self.stderr = None if stderr is None else stderr.decode(self.encoding)
-        self.status = process.returncode
+        self.status = status
         self.running = False
 
         if _use_log(self.log):
@@ -902,6 +3034,305 @@ class Start(Cmd):
         self.start(stdin)
 
 
+# run_many {{{2
+def run_many(commands, max_jobs=None, modes=None, **kwargs):
+    """
+    Run many commands concurrently, yielding each as it terminates.
+
+    commands is an iterable whose items are either Cmd objects that have not
+    yet been run or commands (strings or lists), which are converted to Cmd
+    objects using modes and any other keyword arguments accepted by Cmd.
+    At most max_jobs commands are run at once (the default is the number of
+    CPUs).  Each command is run and waited for on its own thread, so its
+    output is captured as specified by its modes, and it is yielded once it
+    has terminated, with its status, stdout and stderr attributes set.
+
+    If the exit status of a command is not acceptable, the exception is raised
+    when that command would have been yielded.  The commands that have not yet
+    been started are then abandoned, those that are running are allowed to
+    terminate.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    cmds = [
+        cmd if isinstance(cmd, Cmd) else Cmd(cmd, modes=modes, **kwargs)
+        for cmd in commands
+    ]
+
+    def execute(cmd):
+        cmd.run()
+        if not cmd.wait_for_termination:
+            cmd.wait()
+        return cmd
+
+    pool = ThreadPoolExecutor(max_workers=max_jobs or os.cpu_count() or 1)
+    futures = [pool.submit(execute, cmd) for cmd in cmds]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+
+# AsyncCmd class {{{2
+class AsyncCmd(Cmd):
+    # description {{{3
+    """
+    Specify a command that is run as an asyncio subprocess.
+
+    See Cmd for information on the arguments, they and the modes are
+    interpreted in the same way.  The difference is that run(), wait() and
+    kill() are coroutines, so the event loop is not blocked while the command
+    runs, and iter_lines() is an asynchronous generator that yields the output
+    of the command line by line as it becomes available.
+    """
+
+    # run {{{3
+    async def run(self, stdin=None, **kwargs):
+        """
+        Run the command, will wait for it to terminate.
+
+        If stdin is given, it should be a string. Otherwise, no connection is
+        made to stdin of the command.
+
+        Any other arguments must be keyword arguments and they are passed to
+        asyncio.create_subprocess_exec() or asyncio.create_subprocess_shell().
+
+        Returns exit status if wait_for_termination is True.
+        If wait_for_termination is False, you must await wait() or iterate
+        through iter_lines(), otherwise stdin is not applied.
+        """
+        await self._spawn(stdin, **kwargs)
+        if self.wait_for_termination:
+            return await self.wait()
+
+    # _spawn {{{3
+    async def _spawn(self, stdin=None, **kwargs):
+        self.stdin = stdin
+        import asyncio
+        from asyncio.subprocess import PIPE, STDOUT
+
+        cmd = self._prepare()
+
+        # indicate streams to intercept
+        streams = {}
+        if stdin is not None:
+            streams["stdin"] = PIPE
+        if self.save_stdout:
+            streams["stdout"] = PIPE
+        if self.save_stderr:
+            streams["stderr"] = PIPE
+        if self.merge_stderr_into_stdout:
+            streams["stderr"] = STDOUT
+
+        # run the command
+        try:
+            if self.use_shell:
+                if not is_str(cmd):
+                    cmd = " ".join(quote_arg(c) for c in cmd)
+                process = await asyncio.create_subprocess_shell(
+                    cmd, env=self.env, **streams, **kwargs
+                )
+            else:
+                process = await asyncio.create_subprocess_exec(
+                    *cmd, env=self.env, **streams, **kwargs
+                )
+        except OSError as e:
+            if PREFERENCES["use_inform"]:
+                from inform import Error, os_error
+
+                raise Error(
+                    msg=os_error(e), cmd=render_command(self.cmd), template="{msg}"
+                )
+            else:
+                raise
+        self.running = True
+
+        # store needed information
+        self.pid = process.pid
+        self.process = process
+
+    # start {{{3
+    @property
+    def start(self):
+        # start() is not inherited from Cmd, as it would not be awaitable
+        raise AttributeError(
+            "AsyncCmd has no start(), use run() with the w mode instead."
+        )
+
+    # wait {{{3
+    async def wait(self):
+        """
+        Wait for command to terminate.
+
+        This should only be used if wait-for-termination is False.
+
+        Returns exit status of the command.
+        """
+        process = self.process
+
+        stdin = None if self.stdin is None else self.stdin.encode(self.encoding)
+        stdout, stderr = await process.communicate(stdin)
+        return self._finish(stdout, stderr, process.returncode)
+
+    # iter_lines {{{3
+    async def iter_lines(self, stream="stdout"):
+        """
+        Iterate through the lines the command writes to stream.
+
+        stream is either 'stdout' or 'stderr' and it must be captured.  The
+        command is run if it has not been run already.  Lines are yielded with
+        their line terminators as they become available.  Any other captured
+        stream is accumulated as it arrives, so the command cannot stall
+        writing to it, and once the lines are exhausted it is available as an
+        attribute and the exit status is checked as in wait().
+
+        If the iteration is abandoned before the lines are exhausted, the
+        command is killed, its exit status is recorded but not checked.
+        """
+        import asyncio
+
+        if getattr(self, "process", None) is None:
+            await self._spawn()
+        process = self.process
+        readers = dict(stdout=process.stdout, stderr=process.stderr)
+        reader = readers.pop(stream, None)
+        if reader is None:
+            raise ValueError(f"{stream}: not captured.")
+        (other_stream, other), = readers.items()
+
+        async def feed(data):
+            try:
+                process.stdin.write(data)
+                await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            process.stdin.close()
+
+        tasks = []
+        if self.stdin is not None:
+            tasks.append(asyncio.ensure_future(feed(self.stdin.encode(self.encoding))))
+        if other is not None:
+            tasks.append(asyncio.ensure_future(other.read()))
+        exhausted = False
+        try:
+            splitter = _LineSplitter(self.encoding)
+            while True:
+                data = await reader.read(_BUFFER_SIZE)
+                for line in splitter.feed(data):
+                    yield line
+                if not data:
+                    break
+            results = await asyncio.gather(*tasks)
+            status = await process.wait()
+            exhausted = True
+        finally:
+            for task in tasks:
+                task.cancel()
+            if not exhausted:
+                # otherwise the command could be left blocked on a full pipe
+                if process.stdin is not None:
+                    process.stdin.close()
+                await self.kill()
+                self.status = process.returncode
+                self.running = False
+
+        output = {stream: None, other_stream: results[-1] if other else None}
+        self._finish(output["stdout"], output["stderr"], status)
+
+    # poll {{{3
+    def poll(self):
+        """
+        Check to see if process has completed.
+
+        Returns exit status if process is done, otherwise it return None.
+        Any captured output is collected by awaiting wait().
+        """
+        return self.process.returncode
+
+    # kill {{{3
+    async def kill(self):
+        """
+        Kill the process.
+        """
+        try:
+            self.process.kill()
+            await self.process.wait()
+        except AttributeError:
+            # did not get far enough to set self.process
+            pass
+        except ProcessLookupError:
+            # already terminated
+            pass
+
+
+# AsyncRun class {{{2
+class AsyncRun(AsyncCmd):
+    """Run a command as an asyncio subprocess when awaited.
+
+    See Cmd for information on the arguments.
+    Default mode is 'soeW0'.
+
+    Awaiting an AsyncRun object runs the command and returns the object, so:
+        output = (await AsyncRun(['grep', filename], modes='sOeW1')).stdout
+    """
+
+    def __init__(
+        self,
+        cmd,
+        modes=None,
+        stdin=None,
+        env=None,
+        encoding=None,
+        log=None,
+        option_args=None,
+        **kwargs,
+    ):
+        self.cmd = cmd
+        self.stdin = stdin
+        self.use_shell = False
+        self.save_stdout = False
+        self.save_stderr = False
+        self.merge_stderr_into_stdout = False
+        self.wait_for_termination = True
+        self.env = env
+        self.encoding = encoding or PREFERENCES["encoding"]
+        self.log = log
+        self.option_args = option_args
+        self.kwargs = kwargs
+        self._interpret_modes(modes)
+
+    def __await__(self):
+        return self._execute().__await__()
+
+    async def _execute(self):
+        await self.run(self.stdin, **self.kwargs)
+        return self
+
+
+# _LineSplitter class {{{2
+class _LineSplitter(object):
+    # decodes a stream of bytes incrementally and splits it into lines, feed
+    # returns the lines completed by data, an empty data indicates end of stream
+    def __init__(self, encoding):
+        import codecs
+
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.partial = ""
+
+    def feed(self, data):
+        text = self.partial + self.decoder.decode(data, final=not data)
+        lines = text.split("\n")
+        self.partial = lines.pop()
+        lines = [line + "\n" for line in lines]
+        if not data and self.partial:
+            lines.append(self.partial)
+            self.partial = ""
+        return lines
+
+
 # _Accept class {{{2
 class _Accept(object):
     # accept exit codes may be specified as:
@@ -0,0 +1,96 @@
+import asyncio
+import time
+import pytest
+from shlib import AsyncCmd, AsyncRun, cd, to_path
+wd = to_path(__file__).parent
+
+
+def test_async_cmd_beacon():
+    async def main():
+        with cd(wd):
+            cmd = AsyncCmd("./test_prog 1", "sOEW1")
+            status = await cmd.run()
+            return cmd, status
+
+    cmd, status = asyncio.run(main())
+    assert status == 1
+    assert cmd.stdout == "this is stdout.\n"
+    assert cmd.stderr == "this is stderr.\n"
+
+
+def test_async_cmd_quarry():
+    async def main():
+        with cd(wd):
+            cmd = AsyncCmd("./test_prog 2", "sOEW1")
+            await cmd.run()
+
+    with pytest.raises(OSError) as exception:
+        asyncio.run(main())
+    assert str(exception.value) == "[Errno None] this is stderr."
+
+
+def test_async_cmd_cadence():
+    async def main():
+        cmds = [AsyncCmd("sleep 0.5; cat", "SOEw") for i in range(6)]
+        for i, cmd in enumerate(cmds):
+            await cmd.run(stdin="{}\n".format(i))
+        return await asyncio.gather(*(cmd.wait() for cmd in cmds)), cmds
+
+    start = time.monotonic()
+    statuses, cmds = asyncio.run(main())
+    elapsed = time.monotonic() - start
+    assert statuses == [0] * 6
+    assert [c.stdout for c in cmds] == ["{}\n".format(i) for i in range(6)]
+    assert elapsed < 2.5
+
+
+def test_async_cmd_trickle():
+    async def main():
+        cmd = AsyncCmd(
+            "printf 'a\\nb\\n'; printf 'oops\\n' >&2; printf c; exit 3", "SOEw3"
+        )
+        lines = [line async for line in cmd.iter_lines()]
+        return cmd, lines
+
+    cmd, lines = asyncio.run(main())
+    assert lines == ["a\n", "b\n", "c"]
+    assert cmd.stdout is None
+    assert cmd.stderr == "oops\n"
+    assert cmd.status == 3
+
+
+def test_async_run_harbor():
+    async def main():
+        return await AsyncRun("tr a-z A-Z", "sOeW", stdin="harbor\n")
+
+    cmd = asyncio.run(main())
+    assert cmd.stdout == "HARBOR\n"
+    assert cmd.status == 0
+
+
+def test_async_cmd_quoted():
+    async def main():
+        cmd = AsyncCmd(["echo", "a  b", "$HOME", "it's"], "SOeW")
+        await cmd.run()
+        return cmd
+
+    cmd = asyncio.run(main())
+    assert cmd.stdout == "a  b $HOME it's\n"
+    assert not hasattr(cmd, "start")
+
+
+def test_async_cmd_abandon():
+    async def main():
+        cmd = AsyncCmd("yes", "sOEw")
+        lines = cmd.iter_lines()
+        count = 0
+        async for line in lines:
+            count += 1
+            if count == 1000:
+                break
+        await lines.aclose()
+        return cmd
+
+    cmd = asyncio.run(main())
+    assert cmd.process.returncode is not None
+    assert not cmd.running
@@ -1,3 +1,5 @@
+import os
+import pytest
 from shlib import chmod, getmod, mkdir, rm, to_path, touch
 
 
@@ -151,3 +153,132 @@ def test_chmod_quisling():
 
     # cleanup
     rm(d1)
+
+
+@pytest.mark.parametrize("workers", [None, 3])
+def test_chmod_trellis(workers):
+    """change modes of a tree using a symbolic mode"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1 / "a" / "b", d1 / "c")
+    for d in [d1, d1 / "a", d1 / "a" / "b", d1 / "c"]:
+        chmod(0o700, d)
+        for name in ["f1", "f2"]:
+            touch(d / name)
+            chmod(0o600, d / name)
+    chmod(0o700, d1 / "a" / "f2")
+    f3 = to_path("f3")
+    touch(f3)
+    chmod(0o600, f3)
+    os.symlink("../f3", str(d1 / "l1"))
+
+    # run test
+    chmod("go+rX", d1, recursive=True, workers=workers)
+
+    # check
+    assert getmod(d1) == 0o755
+    assert getmod(d1 / "a" / "b") == 0o755
+    assert getmod(d1 / "a" / "b" / "f1") == 0o644
+    assert getmod(d1 / "c" / "f2") == 0o644
+    assert getmod(d1 / "a" / "f2") == 0o755
+    assert getmod(f3) == 0o600
+
+    # cleanup
+    rm(d1, f3)
+
+
+def test_chmod_lockbox():
+    """change modes of a tree, making its directories unreadable"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1 / "a")
+    touch(d1 / "f1", d1 / "a" / "f2")
+
+    # run test
+    chmod(0o400, d1, recursive=True, dir_mode=0o100)
+
+    # check
+    assert getmod(d1) == 0o100
+    chmod("u+rwx", d1, recursive=True)
+    assert getmod(d1) == 0o700
+    assert getmod(d1 / "a") == 0o700
+    assert getmod(d1 / "a" / "f2") == 0o700
+    assert getmod(d1 / "f1") == 0o700
+
+    # cleanup
+    rm(d1)
+
+
+def test_chmod_garble():
+    """reject an invalid symbolic mode"""
+    # setup
+    f1 = to_path("f1")
+    touch(f1)
+
+    # run test
+    with pytest.raises(ValueError):
+        chmod("u+q", f1)
+
+    # cleanup
+    rm(f1)
+
+
+@pytest.mark.parametrize(
+    "mode, before, after",
+    [
+        ("g=u", 0o640, 0o660),
+        ("u=g", 0o460, 0o660),
+        ("u=rwx,g=u,o=", 0o644, 0o770),
+        ("g=u-w,o=g", 0o604, 0o644),
+    ],
+)
+def test_chmod_mimic(mode, before, after):
+    """copy permissions from one class to another"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1)
+    f1 = d1 / "f1"
+    touch(f1)
+    chmod(before, f1)
+
+    # run test
+    chmod(mode, d1, recursive=True)
+
+    # check
+    assert getmod(f1) == after
+
+    # cleanup
+    chmod(0o700, d1)
+    rm(d1)
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_chmod_barrier(monkeypatch, workers):
+    """report a directory that cannot be read while changing a tree"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1 / "a/b")
+    touch(d1 / "a/f", d1 / "a/b/f")
+    chmod(0o644, d1 / "a/f", d1 / "a/b/f")
+    blocked = os.stat(str(d1 / "a/b")).st_ino
+    scandir = os.scandir
+
+    def guarded(path="."):
+        if os.stat(path).st_ino == blocked:
+            raise PermissionError(13, "Permission denied", "d1/a/b")
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", guarded)
+
+    # run test
+    with pytest.raises(PermissionError):
+        chmod(0o600, d1, recursive=True, dir_mode=0o700, workers=workers)
+
+    # check
+    assert getmod(d1 / "a/f") == 0o600
+    assert getmod(d1 / "a/b/f") == 0o644
+    assert getmod(d1 / "a/b") == 0o700
+
+    # cleanup
+    monkeypatch.undo()
+    rm(d1)
@@ -1,5 +1,5 @@
 from inform import Error, Inform
-from shlib import Run, set_prefs, cd, to_path
+from shlib import Cmd, Run, set_prefs, cd, to_path
 wd = to_path(__file__).parent
 
 
@@ -85,3 +85,51 @@ def test_run_ground():
             assert e.status == 1
             assert e.msg == "this is stderr."
         set_prefs(use_inform=False)
+
+
+def test_run_streamline():
+    with cd(wd):
+        cmd = Cmd("./test_prog 1", "sOEw1")
+        assert list(cmd.iter_lines()) == ["this is stdout.\n"]
+        assert cmd.stdout is None
+        assert cmd.stderr == "this is stderr.\n"
+        assert cmd.status == 1
+
+
+def test_run_deluge():
+    # both streams far exceed the pipe buffers, so neither may be left unread
+    script = "for i in $(seq 100000); do echo out $i; echo err $i >&2; done; exit 2"
+    cmd = Cmd(script, "SOEw")
+    count = 0
+    try:
+        for line in cmd.iter_lines("stderr"):
+            count += 1
+            assert line == "err {}\n".format(count)
+        assert False, "expected exception"
+    except OSError as e:
+        assert str(e) == "[Errno None] unexpected exit status (2)."
+    assert count == 100000
+    assert cmd.stdout.count("\n") == 100000
+    assert cmd.stderr is None
+
+
+def test_run_funnel():
+    lines = "".join("line {}\n".format(i) for i in range(50000)) + "tail"
+    cmd = Cmd("cat", "sOew")
+    cmd.run(stdin=lines)
+    assert "".join(cmd.iter_lines()) == lines
+    assert cmd.status == 0
+
+
+def test_run_abandon():
+    cmd = Cmd("yes", "sOEw")
+    lines = cmd.iter_lines()
+    for i, line in enumerate(lines):
+        assert line == "y\n"
+        if i == 1000:
+            break
+    lines.close()
+    assert cmd.process.returncode is not None
+    assert cmd.process.stdout.closed
+    assert cmd.process.stderr.closed
+    assert not cmd.running
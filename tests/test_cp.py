@@ -1,5 +1,10 @@
+import errno
+import hashlib
+import os
+import shutil
 import pytest
-from shlib import cp, mkdir, rm, to_path, touch
+import shlib.shlib
+from shlib import cp, mkdir, rm, to_path, touch, CopySummary
 
 
 def test_cp_downturn():
@@ -399,3 +404,469 @@ def test_cp_convict():
 
     # cleanup
     rm(d1, d2)
+
+
+def test_cp_carafe():
+    """copy contents of files and directories, summarizing the copies"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1)
+    f1 = to_path("d1/f1")
+    f1.write_bytes(bytes(range(256)) * 1000)
+    f2 = to_path("d1/f2")
+    touch(f2)
+    f3 = to_path("f3")
+    d2 = to_path("d2")
+    summary = CopySummary()
+
+    # run test
+    cp(f1, f3, summary=summary)
+    cp(d1, d2, summary=summary)
+
+    # check
+    assert f3.read_bytes() == f1.read_bytes()
+    assert to_path("d2/f1").read_bytes() == f1.read_bytes()
+    assert to_path("d2/f2").read_bytes() == b""
+    assert summary.copied == 3
+    assert summary.bytes == 2 * 256000
+    assert sum(summary.strategies.values()) == 3
+
+    # cleanup
+    rm(d1, d2, f3)
+
+
+def test_cp_sluice(monkeypatch):
+    """fall back when the kernel cannot copy the file"""
+    # setup
+    f1 = to_path("f1")
+    f1.write_text("sluice\n" * 1000)
+    f2 = to_path("f2")
+
+    def unsupported(*args, **kwargs):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    for name in ["copy_file_range", "sendfile"]:
+        if hasattr(os, name):
+            monkeypatch.setattr(os, name, unsupported)
+    summary = CopySummary()
+
+    # run test
+    cp(f1, f2, summary=summary)
+
+    # check
+    assert f2.read_text() == f1.read_text()
+    assert set(summary.strategies) <= {"reflink", "buffered"}
+
+    # cleanup
+    rm(f1, f2)
+
+
+def test_cp_pantry():
+    """copy a file whose contents are generated as it is read"""
+    # setup
+    src = to_path("/proc/self/status")
+    if not src.exists():
+        pytest.skip("requires /proc")
+    f1 = to_path("f1")
+
+    # run test
+    cp(src, f1)
+
+    # check
+    assert "Name:" in f1.read_text()
+
+    # cleanup
+    rm(f1)
+
+
+def test_cp_flotilla():
+    """copy files and directory trees using workers"""
+    # setup
+    d1 = to_path("d1")
+    for i in range(5):
+        mkdir(d1 / str(i) / "sub")
+        for j in range(10):
+            (d1 / str(i) / "f{}".format(j)).write_text("{}{}".format(i, j))
+            (d1 / str(i) / "sub" / "g{}".format(j)).write_text(str(j))
+    os.utime(str(d1 / "0"), (1000000000, 1000000000))
+    f1 = to_path("f1")
+    f1.write_text("f1")
+    d2 = to_path("d2")
+    mkdir(d2)
+    summary = CopySummary()
+
+    # run test
+    cp(d1, f1, d2, workers=4, summary=summary)
+
+    # check
+    def contents(root):
+        return sorted(
+            (str(p.relative_to(root)), p.read_text())
+            for p in root.rglob("*") if p.is_file()
+        )
+    assert contents(d2 / "d1") == contents(d1)
+    assert (d2 / "f1").read_text() == "f1"
+    assert (d2 / "d1" / "0").stat().st_mtime == 1000000000
+    assert summary.copied == 101
+
+    # cleanup
+    rm(d1, d2, f1)
+
+
+def test_cp_scuttle():
+    """collect failures when copying using workers"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1)
+    to_path("d1/f1").write_text("f1")
+    os.symlink("missing", "d1/dangling")
+    f2 = to_path("f2")
+    d2 = to_path("d2")
+    d3 = to_path("d3")
+    mkdir(d3)
+
+    # run test
+    with pytest.raises(FileNotFoundError):
+        cp(f2, to_path("f3"), workers=2)
+    with pytest.raises(shutil.Error) as exception:
+        cp(d1, d2, workers=2)
+    with pytest.raises(OSError) as multiple:
+        cp(d1, f2, d3, workers=2)
+
+    # check
+    assert to_path("d2/f1").read_text() == "f1"
+    assert len(exception.value.args[0]) == 1
+    assert len(multiple.value.args[0]) == 2
+
+    # cleanup
+    rm(d1, d2, d3)
+
+
+def test_cp_ledger():
+    """update a copy of a tree, copying only the files that changed"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1 / "sub")
+    for name in ["f1", "f2", "sub/f3"]:
+        (d1 / name).write_text(name)
+    d2 = to_path("d2")
+    mkdir(d2)
+    first = CopySummary()
+    second = CopySummary()
+    third = CopySummary()
+
+    # run test
+    cp(d1, d2, update=True, summary=first)
+    cp(d1, d2, update=True, summary=second)
+    (d1 / "f2").write_text("changed")
+    (d1 / "sub/f4").write_text("f4")
+    cp(d1, d2, update=True, summary=third)
+
+    # check
+    assert (first.copied, first.skipped) == (3, 0)
+    assert (second.copied, second.skipped) == (0, 3)
+    assert (third.copied, third.skipped) == (2, 2)
+    assert third.skipped_bytes == len("f1") + len("sub/f3")
+    assert to_path("d2/d1/f2").read_text() == "changed"
+    assert to_path("d2/d1/sub/f4").read_text() == "f4"
+
+    # cleanup
+    rm(d1, d2)
+
+
+def test_cp_tally():
+    """update a copy, comparing the contents of the files"""
+    # setup
+    f1 = to_path("f1")
+    f1.write_text("tally")
+    f2 = to_path("f2")
+    f2.write_text("tally")
+    f3 = to_path("f3")
+    f3.write_text("bobby")
+    summary = CopySummary()
+
+    # run test
+    cp(f1, f2, update="checksum", summary=summary)
+    cp(f1, f3, update="checksum", summary=summary)
+
+    # check
+    assert (summary.copied, summary.skipped) == (1, 1)
+    assert f3.read_text() == "tally"
+
+    # cleanup
+    rm(f1, f2, f3)
+
+
+def test_cp_lagoon():
+    """copy a sparse file, preserving its holes"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1)
+    f1 = d1 / "f1"
+    size = 64 * 1024 * 1024
+    with f1.open("wb") as f:
+        f.seek(size // 2)
+        f.write(b"lagoon" * 1000)
+        f.truncate(size)
+    if f1.stat().st_blocks * 512 >= size:
+        rm(d1)
+        pytest.skip("filesystem does not support sparse files")
+    f2 = to_path("f2")
+    d2 = to_path("d2")
+    summary = CopySummary()
+
+    # run test
+    cp(f1, f2, sparse=True, summary=summary)
+    cp(d1, d2, sparse=True, workers=2, summary=summary)
+
+    # check
+    for copy in [f2, d2 / "f1"]:
+        assert copy.stat().st_size == size
+        assert copy.stat().st_blocks * 512 < size // 2
+        assert copy.read_bytes() == f1.read_bytes()
+    assert set(summary.strategies) <= {"reflink", "sparse"}
+
+    # cleanup
+    rm(d1, d2, f2)
+
+
+def test_cp_tether():
+    """copy a tree, preserving its hard links"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1 / "a", d1 / "b")
+    (d1 / "a/f1").write_text("tether")
+    os.link(str(d1 / "a/f1"), str(d1 / "b/f1"))
+    os.link(str(d1 / "a/f1"), str(d1 / "f1"))
+    (d1 / "f2").write_text("f2")
+    d2 = to_path("d2")
+    summary = CopySummary()
+
+    # run test
+    cp(d1, d2, preserve_hardlinks=True, workers=2, summary=summary)
+
+    # check
+    copies = [d2 / "a/f1", d2 / "b/f1", d2 / "f1"]
+    assert len(set(p.stat().st_ino for p in copies)) == 1
+    assert copies[0].stat().st_nlink == 3
+    assert copies[0].stat().st_ino != (d1 / "f1").stat().st_ino
+    assert all(p.read_text() == "tether" for p in copies)
+    assert (d2 / "f2").stat().st_nlink == 1
+    assert summary.strategies["hardlink"] == 2
+    assert summary.bytes == len("tether") + len("f2")
+
+    # cleanup
+    rm(d1, d2)
+
+
+def test_cp_bastion():
+    """copy files atomically, replacing existing files"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1)
+    (d1 / "f1").write_text("new f1")
+    (d1 / "f2").write_text("new f2")
+    d2 = to_path("d2")
+    mkdir(d2 / "d1")
+    (d2 / "d1" / "f1").write_text("old f1")
+    f3 = to_path("f3")
+    f3.write_text("old f3")
+
+    # run test
+    cp(d1 / "f1", f3, atomic=True, fsync=True)
+    cp(d1, d2, atomic=True, fsync="batch", update=True, workers=2)
+
+    # check
+    assert f3.read_text() == "new f1"
+    assert (d2 / "d1" / "f1").read_text() == "new f1"
+    assert (d2 / "d1" / "f2").read_text() == "new f2"
+    assert sorted(p.name for p in (d2 / "d1").iterdir()) == ["f1", "f2"]
+    assert [p.name for p in to_path(".").glob(".f3.*")] == []
+
+    # cleanup
+    rm(d1, d2, f3)
+
+
+def test_cp_palisade():
+    """write a file atomically, retaining its permissions"""
+    # setup
+    f1 = to_path("f1")
+    f1.write_text("old")
+    f1.chmod(0o640)
+
+    # run test
+    count = f1.write_atomic("palisade")
+    f1.write_atomic(b"\x00bytes", fsync=False)
+
+    # check
+    assert count == len("palisade")
+    assert f1.read_bytes() == b"\x00bytes"
+    assert f1.stat().st_mode & 0o777 == 0o640
+    assert [p.name for p in to_path(".").glob(".f1.*")] == []
+
+    # cleanup
+    rm(f1)
+
+
+def test_cp_milestone():
+    """report progress while copying"""
+    # setup
+    f1 = to_path("f1")
+    f1.write_bytes(os.urandom(200000))
+    f2 = to_path("f2")
+    reports = []
+
+    def progress(dest, copied, size, rate):
+        reports.append((dest, copied, size, rate))
+
+    # run test
+    cp(f1, f2, progress=progress)
+
+    # check
+    assert f2.read_bytes() == f1.read_bytes()
+    assert reports[-1][:3] == (str(f2), 200000, 200000)
+    assert all(r[3] >= 0 for r in reports)
+    copied = [r[1] for r in reports]
+    assert copied == sorted(copied)
+
+    # cleanup
+    rm(f1, f2)
+
+
+@pytest.mark.parametrize("atomic", [False, True])
+def test_cp_waypoint(atomic):
+    """resume an interrupted copy"""
+    # setup
+    data = os.urandom(3 * 1024 * 1024)
+    d1 = to_path("d1")
+    mkdir(d1)
+    f1 = d1 / "f1"
+    f1.write_bytes(data)
+    d2 = to_path("d2")
+    mkdir(d2 / "d1")
+    partial = d2 / "d1" / ".f1.cp-partial"
+    partial.write_bytes(data[:2 * 1024 * 1024])
+    summary = CopySummary()
+    f2 = to_path("f2")
+    f2.write_bytes(b"garbage" + data[7:1024])
+
+    # run test
+    cp(d1, d2, resume=True, atomic=atomic, update=True, summary=summary)
+    cp(f1, f2, resume=True, summary=summary)
+
+    # check
+    assert (d2 / "d1" / "f1").read_bytes() == data
+    assert not to_path(d2 / "d1" / ".f1.cp-partial").exists()
+    assert f2.read_bytes() == data
+    reflinked = summary.strategies.get("reflink", 0)
+    assert summary.bytes == 1024 * 1024 + len(data) or reflinked
+
+    # cleanup
+    rm(d1, d2, f2)
+
+
+def test_cp_relic():
+    """resume does not trust a stale destination of the same size"""
+    # setup
+    data = os.urandom(4 * 1024 * 1024)
+    f1 = to_path("f1")
+    f1.write_bytes(data)
+    f2 = to_path("f2")
+    f2.write_bytes(b"old!" + data[4:])
+    partial = to_path(".f2.cp-partial")
+    partial.write_bytes(b"bad!" + data[4:1024])
+    summary = CopySummary()
+
+    # run test
+    cp(f1, f2, resume=True, summary=summary)
+
+    # check
+    assert f2.read_bytes() == data
+    assert not partial.exists()
+    assert summary.copied == 1
+    assert summary.bytes == len(data)
+
+    # cleanup
+    rm(f1, f2)
+
+
+def test_cp_checkpoint(monkeypatch):
+    """resume a large copy after checking a sample of the partial copy"""
+    # setup
+    mb = 1024 * 1024
+    data = os.urandom(42 * mb)
+    f1 = to_path("f1")
+    f1.write_bytes(data)
+    f2 = to_path("f2")
+    to_path(".f2.cp-partial").write_bytes(data[:40 * mb])
+    reports = []
+    read = []
+    pread = os.pread
+
+    def counted(fd, count, offset):
+        data = pread(fd, count, offset)
+        read.append(len(data))
+        return data
+
+    monkeypatch.setattr(os, "pread", counted)
+
+    # run test
+    cp(f1, f2, resume=True, progress=lambda *args: reports.append(args[1]))
+
+    # check
+    assert f2.read_bytes() == data
+    assert sum(read) < 40 * mb
+    assert 40 * mb in reports
+    assert reports[-1] == 42 * mb
+
+    # cleanup
+    rm(f1, f2)
+
+
+def test_cp_seal():
+    """verify copies using their digests"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1)
+    contents = {}
+    for i in range(4):
+        contents[i] = os.urandom(10000 * i)
+        (d1 / "f{}".format(i)).write_bytes(contents[i])
+    d2 = to_path("d2")
+    summary = CopySummary()
+
+    # run test
+    cp(d1, d2, verify="sha256", workers=2, summary=summary)
+
+    # check
+    for i, data in contents.items():
+        dest = str(d2 / "f{}".format(i))
+        assert to_path(dest).read_bytes() == data
+        assert summary.digests[dest] == hashlib.sha256(data).hexdigest()
+
+    # cleanup
+    rm(d1, d2)
+
+
+def test_cp_forgery(monkeypatch):
+    """report copies that do not match their source"""
+    # setup
+    f1 = to_path("f1")
+    f1.write_text("forgery")
+    f2 = to_path("f2")
+    f2.write_text("original")
+    monkeypatch.setattr(
+        shlib.shlib, "_digest", lambda *args, **kwargs: "mismatch"
+    )
+
+    # run test
+    with pytest.raises(OSError) as exception:
+        cp(f1, f2, verify="sha256", atomic=True)
+
+    # check
+    assert exception.value.errno == errno.EIO
+    assert f2.read_text() == "original"
+    assert [p.name for p in to_path(".").glob(".f2.*")] == []
+
+    # cleanup
+    rm(f1, f2)
@@ -0,0 +1,168 @@
+import pytest
+from shlib import leaves, mkdir, rm, to_path, touch
+
+
+def test_leaves_downturn():
+    """find the files in a directory tree"""
+    # setup
+    d1 = to_path("d1")
+    mkdir("d1/d2/d3", "d1/.d4")
+    touch("d1/f1", "d1/.f2", "d1/d2/f3", "d1/d2/d3/f4", "d1/.d4/f5")
+
+    # run test
+    paths = leaves(d1)
+    hidden = leaves(d1, hidden=True)
+
+    # check
+    assert set(str(f) for f in paths) == set(["d1/f1", "d1/d2/f3", "d1/d2/d3/f4"])
+    assert set(str(f) for f in hidden) == set(
+        ["d1/f1", "d1/.f2", "d1/d2/f3", "d1/d2/d3/f4", "d1/.d4/f5"]
+    )
+
+    # cleanup
+    rm(d1)
+
+
+def test_leaves_endorse():
+    """find the files in a directory tree using worker threads"""
+    # setup
+    d1 = to_path("d1")
+    dirs = ["d1/d%s/d%s" % (i, j) for i in range(5) for j in range(5)]
+    mkdir(dirs)
+    files = ["%s/f%s" % (d, k) for d in dirs for k in range(3)]
+    touch(files)
+
+    # run test
+    serial = list(leaves(d1))
+    unordered = list(leaves(d1, workers=4))
+    ordered = list(leaves(d1, workers=4, ordered=True))
+
+    # check
+    assert set(str(f) for f in serial) == set(files)
+    assert set(unordered) == set(serial)
+    assert ordered == serial
+
+    # cleanup
+    rm(d1)
+
+
+def test_leaves_ground():
+    """report errors found when using worker threads"""
+    # setup
+    d1 = to_path("d1")
+    mkdir("d1/d2")
+    touch("d1/f1")
+    d2 = to_path("d1/d2")
+    d2.chmod(0)
+    errors = []
+
+    # run test
+    try:
+        paths = list(leaves(d1, workers=2, report=errors.append))
+    finally:
+        d2.chmod(0o755)
+
+    # check
+    assert [str(f) for f in paths] == ["d1/f1"]
+    if errors:
+        # root can read the directory regardless of its permissions
+        assert isinstance(errors[0], PermissionError)
+
+    # cleanup
+    rm(d1)
+
+
+def test_leaves_cymbal():
+    """find the files in a tree that contains a symbolic link loop"""
+    # setup
+    d1 = to_path("d1")
+    mkdir("d1/d2/d3")
+    touch("d1/f1", "d1/d2/d3/f2")
+    to_path("d1/d2/d3/up").symlink_to("../..")
+    to_path("d1/d2/elsewhere").symlink_to("d3")
+
+    # run test
+    followed = list(leaves(d1))
+    unfollowed = list(leaves(d1, follow_symlinks=False))
+    threaded = list(leaves(d1, workers=3))
+
+    # check
+    expected = set(["d1/f1", "d1/d2/d3/f2", "d1/d2/elsewhere/f2"])
+    assert set(str(f) for f in followed) == expected
+    assert len(followed) == 3
+    assert set(str(f) for f in unfollowed) == set(["d1/f1", "d1/d2/d3/f2"])
+    assert set(str(f) for f in threaded) == expected
+    assert len(threaded) == 3
+
+    # cleanup
+    rm(d1)
+
+
+@pytest.mark.parametrize("workers", [None, 4])
+def test_leaves_mirror(workers):
+    """find files through a symbolic link and its target"""
+    # setup
+    d1 = to_path("d1")
+    mkdir("d1/zz")
+    touch("d1/zz/file")
+    to_path("d1/aa").symlink_to("zz")
+
+    # run test
+    paths = list(leaves(d1, workers=workers, ordered=True))
+
+    # check
+    assert sorted(str(p) for p in paths) == ["d1/aa/file", "d1/zz/file"]
+
+    # cleanup
+    rm(d1)
+
+
+def test_leaves_trumpet():
+    """find the files in a tree that is deeper than the recursion limit"""
+    # setup
+    d1 = to_path("d1")
+    deepest = d1
+    for i in range(1200):
+        deepest = deepest / "d"
+        deepest.mkdir(parents=(i == 0))
+    touch(deepest / "f1")
+
+    # run test
+    paths = list(leaves(d1))
+
+    # check
+    assert paths == [deepest / "f1"]
+
+    # cleanup
+    rm(deepest / "f1")
+    while deepest != d1:
+        deepest.rmdir()
+        deepest = deepest.parent
+    rm(d1)
+
+
+def test_leaves_gathering():
+    """find the files in a directory tree along with their status"""
+    # setup
+    d1 = to_path("d1")
+    mkdir("d1/d2")
+    to_path("d1/f1").write_text("abc")
+    to_path("d1/d2/f2").write_text("abcdef")
+
+    # run test
+    serial = list(leaves(d1, with_stat=True))
+    threaded = list(leaves(d1, with_stat=True, workers=2))
+
+    # check
+    for records in [serial, threaded]:
+        sizes = {str(r.path): r.size for r in records}
+        assert sizes == {"d1/f1": 3, "d1/d2/f2": 6}
+        for record in records:
+            st = record.path.stat()
+            assert record.mtime == st.st_mtime
+            assert record.mode == st.st_mode
+            assert record.inode == st.st_ino
+            assert to_path(record).read_text()
+
+    # cleanup
+    rm(d1)
@@ -1,3 +1,4 @@
+import warnings
 from shlib import cd, ls, mkdir, rm, to_path, touch
 
 
@@ -279,3 +280,183 @@ def test_ls_abominate():
 
     # cleanup
     rm("work")
+
+
+def test_ls_quench():
+    """list with a select pattern that spans directories"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1)
+    d1d1 = to_path("d1/d1")
+    mkdir(d1d1)
+    d1d2 = to_path("d1/d2")
+    mkdir(d1d2)
+    d1f3 = to_path("d1/f3")
+    touch(d1f3)
+    d1d1f1 = to_path("d1/d1/f1")
+    touch(d1d1f1)
+    d1d2f2 = to_path("d1/d2/f2")
+    touch(d1d2f2)
+
+    # run test
+    paths = ls(d1, select="d*/f*")
+
+    # check
+    assert set(str(f) for f in paths) == set(["d1/d1/f1", "d1/d2/f2"])
+
+    # cleanup
+    rm(d1)
+
+
+def test_ls_ember():
+    """list a directory with lists of select and reject constraints"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1)
+    for name in ["a.py", "b.py", "c.txt", "d.rst", "e.pyc", "test_a.py"]:
+        touch(to_path(d1, name))
+
+    # run test
+    paths = ls(d1, select=["*.py", "*.txt", "*.pyc"], reject=["test_*", "*.pyc"])
+
+    # check
+    assert set(str(f) for f in paths) == set(["d1/a.py", "d1/b.py", "d1/c.txt"])
+
+    # cleanup
+    rm(d1)
+
+
+def test_ls_vestry():
+    """recursive list of directory with overlapping select constraints"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1)
+    d1d1 = to_path("d1/d1")
+    mkdir(d1d1)
+    d1d1f1 = to_path("d1/d1/f1.py")
+    touch(d1d1f1)
+    d1f2 = to_path("d1/f2.py")
+    touch(d1f2)
+
+    # run test
+    paths = list(ls(d1, select=["**/*.py", "*/*", "f*"], reject="d1/d1"))
+
+    # check
+    assert sorted(str(f) for f in paths) == ["d1/d1/f1.py", "d1/f2.py"]
+
+    # cleanup
+    rm(d1)
+
+
+def test_ls_lattice():
+    """recursive list of directory that prunes rejected and hidden directories"""
+    # setup
+    d1 = to_path("d1")
+    for d in ["d1/src/sub", "d1/.git/objects", "d1/node_modules/pkg"]:
+        mkdir(d)
+    for f in ["d1/src/f1", "d1/src/sub/f2", "d1/.git/objects/f3"]:
+        touch(f)
+    touch("d1/node_modules/pkg/f4")
+
+    # run test
+    unpruned = ls(d1, select="**/*", reject="**/node_modules")
+    pruned = ls(d1, select="**/*", reject="**/node_modules", prune=True)
+
+    # check
+    assert set(str(f) for f in unpruned) == set([
+        "d1/src", "d1/src/sub", "d1/src/f1", "d1/src/sub/f2",
+        "d1/.git/objects", "d1/.git/objects/f3", "d1/node_modules/pkg",
+        "d1/node_modules/pkg/f4",
+    ])
+    assert set(str(f) for f in pruned) == set([
+        "d1/src", "d1/src/sub", "d1/src/f1", "d1/src/sub/f2",
+    ])
+
+    # cleanup
+    rm(d1)
+
+
+def test_ls_garland():
+    """recursive list of directory with limited depth"""
+    # setup
+    d1 = to_path("d1")
+    mkdir("d1/d2/d3/d4")
+    touch("d1/f1", "d1/d2/f2", "d1/d2/d3/f3", "d1/d2/d3/d4/f4")
+
+    # run test
+    shallow = ls(d1, select="**/*", max_depth=2)
+    dirs = ls(d1, select="**", max_depth=1)
+
+    # check
+    assert set(str(f) for f in shallow) == set(
+        ["d1/f1", "d1/d2", "d1/d2/f2", "d1/d2/d3"]
+    )
+    assert set(str(f) for f in dirs) == set(["d1", "d1/d2"])
+
+    # cleanup
+    rm(d1)
+
+
+def test_ls_harbor():
+    """recursive list of directory using worker threads"""
+    # setup
+    d1 = to_path("d1")
+    dirs = ["d1/d%s/d%s" % (i, j) for i in range(4) for j in range(4)]
+    mkdir(dirs)
+    touch("%s/f1" % d for d in dirs)
+
+    # run test
+    serial = list(ls(d1, select="**/*"))
+    unordered = list(ls(d1, select="**/*", workers=4))
+    ordered = list(ls(d1, select="**/*", workers=4, ordered=True))
+
+    # check
+    assert len(serial) == 4 + 16 + 16
+    assert set(unordered) == set(serial)
+    assert ordered == serial
+
+    # cleanup
+    rm(d1)
+
+
+def test_ls_saddle():
+    """recursive list of directory along with status"""
+    # setup
+    d1 = to_path("d1")
+    mkdir("d1/d2")
+    to_path("d1/f1").write_text("abc")
+    to_path("d1/d2/f2").write_text("abcdef")
+
+    # run test
+    records = list(ls(d1, select="**/*", only="file", with_stat=True))
+    single = list(ls("d1/f1", with_stat=True))
+
+    # check
+    assert {str(r.path): r.size for r in records} == {"d1/f1": 3, "d1/d2/f2": 6}
+    assert [(str(r.path), r.size) for r in single] == [("d1/f1", 3)]
+    assert sorted(str(r) for r in records) == ["d1/d2/f2", "d1/f1"]
+    assert to_path(single[0]).read_text() == "abc"
+
+    # cleanup
+    rm(d1)
+
+
+def test_ls_bracket():
+    """select paths using character classes that contain brackets"""
+    # setup
+    d1 = to_path("d1")
+    mkdir("d1/d2")
+    touch("d1/d2/a[1]", "d1/b1", "d1/c~")
+
+    # run test
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        bracketed = list(ls(d1, select="**/*[[]1]*"))
+        tilde = list(ls(d1, select="*[~&|]", reject="**/*[[]*"))
+
+    # check
+    assert [str(p) for p in bracketed] == ["d1/d2/a[1]"]
+    assert [str(p) for p in tilde] == ["d1/c~"]
+
+    # cleanup
+    rm(d1)
@@ -110,3 +110,38 @@ def test_mkdir_brain():
 
     # cleanup
     rm(d1d1)
+
+
+def test_mkdir_thicket():
+    """make many directories that share parents"""
+    # setup
+    d1 = to_path("d1")
+    leaves = [
+        d1 / "a" / str(i) / "b" / str(j) for i in range(10) for j in range(10)
+    ]
+
+    # run test
+    mkdir(reversed(leaves), leaves, d1 / "a")
+
+    # check
+    assert all(leaf.is_dir() for leaf in leaves)
+    assert len(list(d1.rglob("*"))) == 1 + 10 + 10 + 100
+
+    # cleanup
+    rm(d1)
+
+
+def test_mkdir_burrow():
+    """make a directory that is deeper than the recursion limit"""
+    # setup
+    depth = 1200
+    deepest = to_path(*["d1"] + ["d"] * (depth - 1))
+
+    # run test
+    mkdir(deepest)
+
+    # check
+    assert deepest.is_dir()
+
+    # cleanup
+    rm("d1", workers=2)
@@ -1,5 +1,8 @@
+import errno
+import os
 import pytest
-from shlib import mkdir, mv, rm, to_path, touch
+import shlib.shlib
+from shlib import mkdir, mv, rm, rm_wait, to_path, touch
 
 
 def test_mv_downturn():
@@ -207,3 +210,58 @@ def test_mv_swine():
 
     # cleanup
     rm(d1, d2)
+
+
+def test_mv_lantern():
+    """rename file over a broken symbolic link"""
+    # setup
+    f1 = to_path("f1")
+    f1.write_text("lantern")
+    l1 = to_path("l1")
+    os.symlink("missing", str(l1))
+
+    # run test
+    mv(f1, l1)
+
+    # check
+    assert not l1.is_symlink()
+    assert l1.read_text() == "lantern"
+    assert not f1.exists()
+
+    # cleanup
+    rm(l1)
+
+
+def test_mv_ferry(monkeypatch):
+    """move directory and file across filesystems"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1 / "sub")
+    (d1 / "sub/f1").write_text("ferry")
+    os.link(str(d1 / "sub/f1"), str(d1 / "f1"))
+    os.symlink("sub/f1", str(d1 / "l1"))
+    f2 = to_path("f2")
+    f2.write_text("f2")
+    d2 = to_path("d2")
+    mkdir(d2)
+
+    def cross_device(src, dest):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV), src, None, dest)
+
+    monkeypatch.setattr(shlib.shlib, "_rename_noreplace", cross_device)
+
+    # run test
+    mv(d1, f2, d2, workers=2)
+    rm_wait()
+
+    # check
+    assert not d1.exists()
+    assert not f2.exists()
+    assert (d2 / "f2").read_text() == "f2"
+    assert (d2 / "d1/sub/f1").read_text() == "ferry"
+    assert (d2 / "d1/f1").stat().st_ino == (d2 / "d1/sub/f1").stat().st_ino
+    assert os.readlink(str(d2 / "d1/l1")) == "sub/f1"
+    assert [p.name for p in to_path(".").glob(".d1.*")] == []
+
+    # cleanup
+    rm(d2)
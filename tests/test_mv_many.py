@@ -0,0 +1,124 @@
+import errno
+import pytest
+from shlib import mkdir, mv_many, rm, to_path
+
+
+def test_mv_many_rotate():
+    """rotate log files"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1)
+    for i in range(4):
+        (d1 / "log.{}".format(i)).write_text(str(i))
+
+    # run test
+    mv_many((d1 / "log.{}".format(i), d1 / "log.{}".format(i + 1))
+            for i in range(4))
+
+    # check
+    assert sorted(p.name for p in d1.iterdir()) == [
+        "log.1", "log.2", "log.3", "log.4"
+    ]
+    for i in range(1, 5):
+        assert (d1 / "log.{}".format(i)).read_text() == str(i - 1)
+
+    # cleanup
+    rm(d1)
+
+
+def test_mv_many_swap():
+    """swap and rotate names in cycles"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1 / "a")
+    for name in "bcde":
+        (d1 / name).write_text(name)
+
+    # run test
+    mv_many([
+        (d1 / "a", d1 / "b"), (d1 / "b", d1 / "a"),
+        (d1 / "c", d1 / "d"), (d1 / "d", d1 / "e"), (d1 / "e", d1 / "c"),
+    ])
+
+    # check
+    assert (d1 / "b").is_dir()
+    assert (d1 / "a").read_text() == "b"
+    assert (d1 / "d").read_text() == "c"
+    assert (d1 / "e").read_text() == "d"
+    assert (d1 / "c").read_text() == "e"
+    assert sorted(p.name for p in d1.iterdir()) == ["a", "b", "c", "d", "e"]
+
+    # cleanup
+    rm(d1)
+
+
+def test_mv_many_validate():
+    """reject plans with collisions before renaming anything"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1)
+    for name in "abc":
+        (d1 / name).write_text(name)
+
+    # run test
+    with pytest.raises(FileExistsError):
+        mv_many([(d1 / "a", d1 / "x"), (d1 / "b", d1 / "c")])
+    with pytest.raises(FileExistsError):
+        mv_many([(d1 / "a", d1 / "x"), (d1 / "b", d1 / "x")])
+    with pytest.raises(FileNotFoundError):
+        mv_many([(d1 / "a", d1 / "x"), (d1 / "missing", d1 / "y")])
+
+    # check
+    assert sorted(p.name for p in d1.iterdir()) == ["a", "b", "c"]
+
+    # cleanup
+    rm(d1)
+
+
+def test_mv_many_overwrite():
+    """replace existing files"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1 / "c")
+    (d1 / "c" / "f").write_text("f")
+    for name in "ab":
+        (d1 / name).write_text(name)
+
+    # run test
+    mv_many([(d1 / "a", d1 / "b"), (d1 / "b", d1 / "c")], overwrite=True)
+
+    # check
+    assert sorted(p.name for p in d1.iterdir()) == ["b", "c"]
+    assert (d1 / "b").read_text() == "a"
+    assert (d1 / "c").read_text() == "b"
+
+    # cleanup
+    rm(d1)
+
+
+def test_mv_many_rollback():
+    """undo the renames when one fails"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1 / "d")
+    for name in "abc":
+        (d1 / name).write_text(name)
+    (d1 / "d" / "f").write_text("f")
+    (d1 / "e").write_text("e")
+
+    # run test
+    with pytest.raises(OSError) as exception:
+        # the last rename fails as the parent of its dest is a file
+        mv_many([
+            (d1 / "a", d1 / "x"), (d1 / "b", d1 / "a"),
+            (d1 / "c", d1 / "b"), (d1 / "e", d1 / "d" / "f" / "g"),
+        ], overwrite=True)
+
+    # check
+    assert exception.value.errno in (errno.ENOTDIR, errno.ENOENT)
+    assert sorted(p.name for p in d1.iterdir()) == ["a", "b", "c", "d", "e"]
+    for name in "abce":
+        assert (d1 / name).read_text() == name
+
+    # cleanup
+    rm(d1)
@@ -1,4 +1,5 @@
-from shlib import mkdir, rm, to_path, touch
+import time
+from shlib import mkdir, rm, rm_wait, to_path, touch
 
 
 def test_rm_downturn():
@@ -58,3 +59,93 @@ def test_rm_cymbal():
     # check
     assert not d1.exists()
     assert not f2.exists()
+
+
+def test_rm_trellis():
+    """remove directory trees using worker threads"""
+    # setup
+    d1 = to_path("d1")
+    dirs = ["d1/d%s/d%s" % (i, j) for i in range(4) for j in range(4)]
+    mkdir(dirs)
+    touch("%s/f%s" % (d, k) for d in dirs for k in range(3))
+    d2 = to_path("d2")
+    mkdir(d2)
+    f1 = to_path("d2/f1")
+    touch(f1)
+    link = to_path("d1/link")
+    link.symlink_to("../d2")
+    f3 = to_path("f3")
+    touch(f3)
+
+    # run test
+    rm(d1, f3, workers=4)
+
+    # check
+    assert not d1.exists()
+    assert not f3.exists()
+    assert f1.is_file()
+
+    # cleanup
+    rm(d2)
+
+
+def test_rm_harness():
+    """remove directory trees in the background"""
+    # setup
+    d1 = to_path("d1")
+    mkdir("d1/d2/d3")
+    touch("d1/f1", "d1/d2/f2", "d1/d2/d3/f3")
+    d4 = to_path("d4")
+    mkdir(d4)
+    touch("d4/f4")
+    f5 = to_path("f5")
+    touch(f5)
+
+    # run test
+    rm(d1, f5, background=True)
+    rm(d4, background=True, workers=2)
+
+    # check
+    assert not d1.exists()
+    assert not d4.exists()
+    assert not f5.exists()
+    assert rm_wait()
+    assert not [p for p in to_path(".").iterdir() if ".rm-" in p.name]
+
+
+def test_rm_scavenge():
+    """remove trees left behind by interrupted background removals"""
+    # setup
+    d1 = to_path("d1")
+    mkdir("d1/keep", "d1/d2/d3", "d1/.d4.rm-%s/d5" % ("0" * 32))
+    touch("d1/d2/d3/f1", "d1/.d4.rm-%s/d5/f2" % ("0" * 32))
+
+    # run test
+    rm(d1 / "d2", background=True)
+
+    # check
+    assert rm_wait()
+    assert [p.name for p in d1.iterdir()] == ["keep"]
+
+    # cleanup
+    rm(d1)
+
+
+def test_rm_detach():
+    """remove directory trees in detached processes"""
+    # setup
+    d1 = to_path("d1")
+    mkdir("d1/d2/d3")
+    touch("d1/f1", "d1/d2/d3/f2")
+
+    # run test
+    rm(d1, background="detach")
+
+    # check
+    assert not d1.exists()
+    for i in range(100):
+        if not [p for p in to_path(".").iterdir() if ".rm-" in p.name]:
+            break
+        time.sleep(0.05)
+    else:
+        assert False, "detached removal did not complete"
@@ -0,0 +1,39 @@
+import time
+import pytest
+from shlib import Cmd, cd, run_many, to_path
+wd = to_path(__file__).parent
+
+
+def test_run_many_relay():
+    with cd(wd):
+        cmds = [Cmd("./test_prog {}".format(i), "sOEW{}".format(i)) for i in range(4)]
+        done = list(run_many(cmds, max_jobs=2))
+        assert sorted(done, key=lambda c: c.status) == cmds
+        for i, cmd in enumerate(cmds):
+            assert cmd.stdout == "this is stdout.\n"
+            assert cmd.stderr == "this is stderr.\n"
+            assert cmd.status == i
+
+
+def test_run_many_sprint():
+    cmds = ["sleep 0.5; echo {}".format(i) for i in range(6)]
+    start = time.monotonic()
+    done = list(run_many(cmds, max_jobs=6, modes="SOeW"))
+    elapsed = time.monotonic() - start
+    assert sorted(c.stdout for c in done) == ["{}\n".format(i) for i in range(6)]
+    assert elapsed < 2.5
+
+
+def test_run_many_order():
+    cmds = ["sleep 0.6; echo slow", "echo fast"]
+    done = list(run_many(cmds, max_jobs=2, modes="SOeW"))
+    assert [c.stdout for c in done] == ["fast\n", "slow\n"]
+
+
+def test_run_many_stumble():
+    with cd(wd):
+        cmds = ["./test_prog 0", "./test_prog 1", "./test_prog 0"]
+        with pytest.raises(OSError) as exception:
+            for cmd in run_many(cmds, max_jobs=1, modes="sOEW"):
+                assert cmd.status == 0
+        assert str(exception.value) == "[Errno None] this is stderr."
@@ -0,0 +1,79 @@
+import os
+import pytest
+from shlib import (
+    chmod, getmod, getmod_many, leaves, mkdir, rm, stat_many, to_path, touch
+)
+
+
+@pytest.mark.parametrize("workers", [None, 4])
+def test_stat_many_census(workers):
+    """stat many files"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1)
+    paths = []
+    for i in range(600):
+        path = d1 / "f{}".format(i)
+        path.write_text("x" * i)
+        paths.append(path)
+
+    # run test
+    stats = stat_many(paths, workers=workers)
+
+    # check
+    assert len(stats) == 600
+    assert stats.paths == paths
+    for i, path in enumerate(paths):
+        st = os.stat(str(path))
+        assert stats.size[i] == i
+        assert stats.mode[i] == st.st_mode
+        assert stats.uid[i] == st.st_uid
+        assert stats.gid[i] == st.st_gid
+        assert stats.mtime[i] == st.st_mtime
+
+    # cleanup
+    rm(d1)
+
+
+def test_stat_many_vanish():
+    """stat paths that do not exist"""
+    # setup
+    f1 = to_path("f1")
+    touch(f1)
+    f2 = to_path("f2")
+    errors = []
+
+    # run test
+    stats = stat_many([f2, f1], report=errors.append, workers=2)
+
+    # check
+    assert len(stats) == 2
+    assert stats.mode[0] == 0
+    assert stats.mode[1] == os.stat(str(f1)).st_mode
+    assert [e.filename for e in errors] == [str(f2)]
+    with pytest.raises(FileNotFoundError):
+        stat_many([f1, f2])
+
+    # cleanup
+    rm(f1)
+
+
+def test_stat_many_audit():
+    """get the permissions of the files found by walking a tree"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1 / "a")
+    touch(d1 / "f1", d1 / "a" / "f2")
+    chmod(0o640, d1 / "f1")
+    chmod(0o604, d1 / "a" / "f2")
+
+    # run test
+    found = list(leaves(d1))
+    modes = getmod_many(found, workers=2)
+
+    # check
+    assert list(modes) == [getmod(path) for path in found]
+    assert sorted(modes) == [0o604, 0o640]
+
+    # cleanup
+    rm(d1)
@@ -1,4 +1,6 @@
-from shlib import rm, to_path, touch
+import os
+import pytest
+from shlib import mkdir, rm, to_path, touch
 
 
 def test_touch_downturn():
@@ -64,3 +66,97 @@ def test_touch_cymbal():
 
     # cleanup
     rm(f1, f2)
+
+
+def test_touch_hourglass():
+    """touch files, giving them specific times"""
+    # setup
+    d1 = to_path("d1")
+    mkdir(d1 / "a", d1 / "b")
+    f1 = d1 / "a" / "f1"
+    touch(f1)
+    files = [d1 / name / str(i) for name in "ab" for i in range(5)]
+
+    # run test
+    touch(files, times=(1000000000, 1200000000), workers=2)
+
+    # check
+    for f in files:
+        assert f.is_file()
+        assert f.stat().st_atime == 1000000000
+        assert f.stat().st_mtime == 1200000000
+    assert f1.stat().st_mtime != 1200000000
+
+    # cleanup
+    rm(d1)
+
+
+def test_touch_sundial():
+    """touch files, giving them the times of a reference"""
+    # setup
+    f1 = to_path("f1")
+    touch(f1, times=(1000000000.5, 1100000000.25))
+    f2 = to_path("f2")
+    f3 = to_path("f3")
+    touch(f3)
+
+    # run test
+    touch(f2, f3, reference=f1)
+
+    # check
+    for f in [f2, f3]:
+        assert f.stat().st_atime_ns == f1.stat().st_atime_ns
+        assert f.stat().st_mtime_ns == f1.stat().st_mtime_ns
+
+    # cleanup
+    rm(f1, f2, f3)
+
+
+def test_touch_hollow():
+    """touch a file in a nonexistent directory"""
+    # run test
+    with pytest.raises(FileNotFoundError):
+        touch(to_path("d1/f1"))
+
+
+def test_touch_summit(monkeypatch):
+    """touch the root directory"""
+    # setup
+    calls = []
+
+    def utime(path, **kwargs):
+        calls.append(path)
+
+    monkeypatch.setattr(os, "utime", utime)
+    monkeypatch.setattr(os, "supports_dir_fd", os.supports_dir_fd | {utime})
+
+    # run test
+    touch("/")
+
+    # check
+    assert calls == ["/"]
+
+
+def test_touch_rebuff(monkeypatch):
+    """fall back to opening a file whose times cannot be set"""
+    # setup
+    f1 = to_path("f1")
+    f1.write_text("rebuff")
+    utime = os.utime
+
+    def refuse(path, *args, **kwargs):
+        if not isinstance(path, int):
+            raise PermissionError(1, "Operation not permitted", path)
+        return utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "utime", refuse)
+
+    # run test
+    touch(f1)
+
+    # check
+    assert f1.read_text() == "rebuff"
+
+    # cleanup
+    monkeypatch.undo()
+    rm(f1)